@@ -0,0 +1,232 @@
+"""Compact, bounded aggregates for learned patterns and equipment insights"""
+import sys
+import time
+from datetime import datetime
+
+# Distinct values tracked per aggregate; beyond this the rarest are evicted
+ISSUE_CAPACITY = 16
+SYMPTOM_CAPACITY = 32
+
+
+def _intern(value):
+    return sys.intern(str(value).strip())
+
+
+def _timestamp(value):
+    """Epoch seconds from a stored float or a legacy ISO-8601 string"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class TopKCounter:
+    """Space-Saving heavy-hitter counter holding at most `capacity` items.
+
+    Counts are exact until more than `capacity` distinct items have been
+    seen. After that a new item replaces the current minimum and inherits
+    its count, so any item whose true frequency exceeds total/capacity is
+    guaranteed to be retained. `errors` records each item's possible
+    overestimate.
+    """
+
+    __slots__ = ("capacity", "counts", "errors")
+
+    def __init__(self, capacity, counts=None, errors=None):
+        self.capacity = capacity
+        self.counts = {_intern(item): n for item, n in (counts or {}).items()}
+        self.errors = {_intern(item): n for item, n in (errors or {}).items() if n}
+
+    def add(self, item, n=1):
+        item = _intern(item)
+        if not item:
+            return
+        counts = self.counts
+        if item in counts:
+            counts[item] += n
+        elif len(counts) < self.capacity:
+            counts[item] = n
+        else:
+            victim = min(counts, key=counts.get)
+            floor = counts.pop(victim)
+            self.errors.pop(victim, None)
+            counts[item] = floor + n
+            self.errors[item] = floor
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def merge(self, other):
+        """Add another counter's counts, e.g. one exported from another instance"""
+        for item, n in other.counts.items():
+            self.add(item, n)
+            if item in self.counts and other.errors.get(item):
+                self.errors[item] = self.errors.get(item, 0) + other.errors[item]
+
+    def most_common(self, n=None):
+        """[(item, count), ...] by descending count, ties broken alphabetically"""
+        ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return ranked if n is None else ranked[:n]
+
+    def to_dict(self):
+        return {"counts": dict(self.counts), "errors": dict(self.errors)}
+
+    @classmethod
+    def from_dict(cls, capacity, data):
+        return cls(capacity, data.get("counts"), data.get("errors"))
+
+
+class PatternStats:
+    """Aggregates for one equipment/symptom/environment combination.
+
+    Memory is constant in the number of cases: issues and parts are
+    capped heavy-hitter counters, severities a small counter, timestamps
+    floats.
+    """
+
+    __slots__ = ("equipment_type", "symptoms", "environment", "count", "issues", "parts", "severity",
+                 "first_seen", "last_used", "has_images")
+
+    def __init__(self, equipment_type, symptoms, environment, count=0, issues=None, severity=None,
+                 first_seen=None, last_used=None, has_images=False, parts=None):
+        self.equipment_type = _intern(equipment_type)
+        self.symptoms = tuple(_intern(value) for value in symptoms)
+        self.environment = tuple(_intern(value) for value in environment)
+        self.count = count
+        self.issues = issues or TopKCounter(ISSUE_CAPACITY)
+        self.parts = parts or TopKCounter(ISSUE_CAPACITY)
+        self.severity = {_intern(level): n for level, n in (severity or {}).items()}
+        now = time.time()
+        self.first_seen = now if first_seen is None else first_seen
+        self.last_used = now if last_used is None else last_used
+        self.has_images = has_images
+
+    def record(self, key_issues, severity, has_images=False, parts=()):
+        self.count += 1
+        self.last_used = time.time()
+        severity = _intern(severity)
+        self.severity[severity] = self.severity.get(severity, 0) + 1
+        self.issues.update(key_issues)
+        self.parts.update(parts)
+        self.has_images = self.has_images or has_images
+
+    def merge(self, other):
+        """Fold in the same pattern's aggregates from another knowledge base"""
+        self.count += other.count
+        self.issues.merge(other.issues)
+        self.parts.merge(other.parts)
+        for level, n in other.severity.items():
+            self.severity[level] = self.severity.get(level, 0) + n
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_used = max(self.last_used, other.last_used)
+        self.has_images = self.has_images or other.has_images
+
+    def summary(self, **extra):
+        """Plain dict used by prompts and the UI"""
+        return dict(
+            count=self.count,
+            equipment_type=self.equipment_type,
+            symptoms=list(self.symptoms),
+            environment=list(self.environment),
+            common_issues=[issue for issue, _n in self.issues.most_common()],
+            common_parts=[part for part, _n in self.parts.most_common()],
+            severity_dist=dict(self.severity),
+            first_seen=datetime.fromtimestamp(self.first_seen).isoformat(),
+            last_used=datetime.fromtimestamp(self.last_used).isoformat(),
+            has_images=self.has_images,
+            **extra
+        )
+
+    def to_dict(self):
+        return {
+            "equipment_type": self.equipment_type,
+            "symptoms": list(self.symptoms),
+            "environment": list(self.environment),
+            "count": self.count,
+            "issues": self.issues.to_dict(),
+            "parts": self.parts.to_dict(),
+            "severity": self.severity,
+            "first_seen": self.first_seen,
+            "last_used": self.last_used,
+            "has_images": self.has_images,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Load a stored pattern, including the older list/ISO-string format"""
+        if "issues" in data:
+            issues = TopKCounter.from_dict(ISSUE_CAPACITY, data["issues"])
+        else:
+            issues = TopKCounter(ISSUE_CAPACITY)
+            issues.update(data.get("common_issues", ()))
+        return cls(
+            data["equipment_type"],
+            data.get("symptoms", ()),
+            data.get("environment", ()),
+            count=data.get("count", 0),
+            issues=issues,
+            severity=data.get("severity", data.get("severity_dist")),
+            first_seen=_timestamp(data.get("first_seen")),
+            last_used=_timestamp(data.get("last_used")),
+            has_images=bool(data.get("has_images")),
+            parts=TopKCounter.from_dict(ISSUE_CAPACITY, data.get("parts", {})),
+        )
+
+
+class EquipmentStats:
+    """Per-equipment totals and symptom frequencies"""
+
+    __slots__ = ("total_cases", "symptoms", "first_case", "cases_with_images")
+
+    def __init__(self, total_cases=0, symptoms=None, first_case=None, cases_with_images=0):
+        self.total_cases = total_cases
+        self.symptoms = symptoms or TopKCounter(SYMPTOM_CAPACITY)
+        self.first_case = time.time() if first_case is None else first_case
+        self.cases_with_images = cases_with_images
+
+    def record(self, symptoms, has_images=False):
+        self.total_cases += 1
+        self.symptoms.update(symptoms)
+        if has_images:
+            self.cases_with_images += 1
+
+    def merge(self, other):
+        """Fold in the same equipment type's totals from another knowledge base"""
+        self.total_cases += other.total_cases
+        self.symptoms.merge(other.symptoms)
+        self.first_case = min(self.first_case, other.first_case)
+        self.cases_with_images += other.cases_with_images
+
+    def summary(self, top=5):
+        return {
+            "total_cases": self.total_cases,
+            "common_symptoms": self.symptoms.most_common(top),
+            "first_case": datetime.fromtimestamp(self.first_case).isoformat(),
+            "cases_with_images": self.cases_with_images,
+        }
+
+    def to_dict(self):
+        return {
+            "total_cases": self.total_cases,
+            "symptoms": self.symptoms.to_dict(),
+            "first_case": self.first_case,
+            "cases_with_images": self.cases_with_images,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Load stored insights, including the older ever-growing common_symptoms list"""
+        if "symptoms" in data:
+            symptoms = TopKCounter.from_dict(SYMPTOM_CAPACITY, data["symptoms"])
+        else:
+            symptoms = TopKCounter(SYMPTOM_CAPACITY)
+            symptoms.update(data.get("common_symptoms", ()))
+        return cls(
+            total_cases=data.get("total_cases", 0),
+            symptoms=symptoms,
+            first_case=_timestamp(data.get("first_case")),
+            cases_with_images=data.get("cases_with_images", 0),
+        )
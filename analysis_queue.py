@@ -0,0 +1,94 @@
+"""Background image analysis shared by every session and rerun"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# analyze() reports failures as text starting with this marker instead of raising
+FAILURE_PREFIX = "❌"
+
+
+class AnalysisQueue:
+    """Runs image analyses on a process-wide pool, deduplicated by cache key.
+
+    Successful results are written to `cache`, so later reruns pick them
+    up with lookup() even though the script run that queued them has
+    ended. Failed results are kept until the key is resubmitted with
+    retry_failed=True. Jobs that have not started yet can be cancelled,
+    so uploads removed before submit cost no vision call, unless a
+    diagnosis has claimed them: a claimed key is never cancelled until
+    every claim on it is released.
+    """
+
+    def __init__(self, analyze, cache, max_workers=4):
+        self._analyze = analyze
+        self._cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="image-analysis")
+        self._jobs = {}
+        # key -> number of submitters waiting on the result
+        self._claims = {}
+        # Reentrant: cancelling a future runs its done callback, which takes the lock, on this thread
+        self._lock = threading.RLock()
+
+    def lookup(self, key):
+        """Return (state, analysis) where state is 'done', 'pending', 'failed' or None if never queued"""
+        analysis = self._cache.get(key)
+        if analysis is not None:
+            return "done", analysis
+        with self._lock:
+            future = self._jobs.get(key)
+        if future is None or future.cancelled():
+            return None, None
+        if not future.done():
+            return "pending", None
+        analysis = future.result()
+        return ("failed" if analysis.startswith(FAILURE_PREFIX) else "done"), analysis
+
+    def submit(self, key, *args, retry_failed=False, claim=False):
+        """Queue analyze(*args) under key unless it is already queued, running or finished.
+
+        Returns the job's Future. With claim=True the caller will wait on
+        it, so cancel() leaves the key alone until release(key).
+        """
+        with self._lock:
+            if claim:
+                self._claims[key] = self._claims.get(key, 0) + 1
+            future = self._jobs.get(key)
+            if future is not None and not future.cancelled():
+                failed = future.done() and future.result().startswith(FAILURE_PREFIX)
+                if not (failed and retry_failed):
+                    return future
+            future = self._jobs[key] = self._executor.submit(self._run, key, *args)
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def release(self, key):
+        """Drop one claim taken by submit(..., claim=True)"""
+        with self._lock:
+            remaining = self._claims.get(key, 0) - 1
+            if remaining > 0:
+                self._claims[key] = remaining
+            else:
+                self._claims.pop(key, None)
+
+    def cancel(self, key):
+        """Drop a job that has not started yet and nobody has claimed; running jobs finish and are cached"""
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is not None and key not in self._claims:
+                # A successful cancel runs _finished, which drops the job
+                future.cancel()
+
+    def _run(self, key, *args):
+        try:
+            analysis = self._analyze(*args)
+        except Exception as e:
+            analysis = f"{FAILURE_PREFIX} Image analysis failed: {str(e)}"
+        if not analysis.startswith(FAILURE_PREFIX):
+            self._cache.set(key, analysis)
+        return analysis
+
+    def _finished(self, key, future):
+        # Successes live in the cache from here on; failures stay visible until retried
+        if future.cancelled() or not future.result().startswith(FAILURE_PREFIX):
+            with self._lock:
+                if self._jobs.get(key) is future:
+                    del self._jobs[key]
@@ -1,12 +1,23 @@
 import streamlit as st
-import google.generativeai as genai
 import os
-from datetime import datetime
-import json
-import re
-import base64
+import time
 from io import BytesIO
 
+import config
+from archive import export_archive, import_archive, is_parquet, parquet_available
+from cache import make_key
+from imaging import preprocess_image
+from jobs import FAILED, FINISHED_STATES
+from metrics import format_tokens
+from pipeline import analyze_images_concurrently, analyze_on_upload, image_analysis_key
+from resilience import CircuitOpenError, RateLimitTimeout
+from resources import (get_analysis_cache, get_analysis_queue, get_diagnosis_jobs, get_gemini_client,
+                       get_image_cache, get_knowledge_base, get_metrics)
+
+# Sections that rerun on their own; Streamlit releases without fragments (including
+# the pinned 1.28) run them with the rest of the script
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
 # Set up the page
 st.set_page_config(
     page_title="InsightFlow - AI Maintenance Assistant",
@@ -24,17 +35,25 @@ with st.sidebar:
     api_key = st.text_input("Enter your Google AI Studio API Key:", type="password")
     if api_key:
         os.environ['GOOGLE_API_KEY'] = api_key
-        genai.configure(api_key=api_key)
+        get_gemini_client().configure(api_key)
         st.success("✅ API Key configured!")
     
     st.markdown("---")
     st.header("📊 Quick Stats")
-    if 'diagnosis_history' in st.session_state:
-        st.metric("Cases Processed", len(st.session_state.diagnosis_history))
-    if 'learned_patterns' in st.session_state:
-        st.metric("Patterns Learned", len(st.session_state.learned_patterns))
+    knowledge_base = get_knowledge_base()
+    st.metric("Cases Processed", knowledge_base.case_count())
+    st.metric("Patterns Learned", knowledge_base.pattern_count())
+    # Filled at the end of the run so counters include this rerun's lookups
+    cache_stats_placeholder = st.empty()
+    prompt_size_placeholder = st.empty()
     st.metric("AI Model", "Gemini 1.5 Pro")
-    st.metric("Status", "🟢 Online")
+    breaker_state = get_gemini_client().breaker.state
+    if breaker_state == "open":
+        st.metric("Status", "🔴 Degraded", help="Gemini calls are failing repeatedly; new calls are paused briefly")
+    elif breaker_state == "half-open":
+        st.metric("Status", "🟡 Recovering")
+    else:
+        st.metric("Status", "🟢 Online")
     
     st.markdown("---")
     st.header("🎯 Features")
@@ -49,167 +68,195 @@ if 'diagnosis_history' not in st.session_state:
     st.session_state.diagnosis_history = []
 if 'expert_mode' not in st.session_state:
     st.session_state.expert_mode = False
-if 'learned_patterns' not in st.session_state:
-    st.session_state.learned_patterns = {}
-if 'equipment_insights' not in st.session_state:
-    st.session_state.equipment_insights = {}
 if 'uploaded_images' not in st.session_state:
     st.session_state.uploaded_images = []
+if 'analysis_keys' not in st.session_state:
+    st.session_state.analysis_keys = set()
+if 'collected_jobs' not in st.session_state:
+    st.session_state.collected_jobs = set()
 
 # Image processing functions
 def process_uploaded_image(uploaded_file):
-    """Process uploaded image and return PIL Image object"""
+    """Process uploaded image and return a ProcessedImage with preview and model payload"""
     try:
-        from PIL import Image
-        image = Image.open(uploaded_file)
-        
-        # Convert to RGB if necessary
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-            
-        # Resize if too large (for performance)
-        max_size = (1024, 1024)
-        image.thumbnail(max_size, Image.Resampling.LANCZOS)
-        
-        return image
+        image_bytes = uploaded_file.getvalue()
+        digest = make_key(image_bytes)
+        cache = get_image_cache()
+        key = make_key("processed_image", digest, config.IMAGE_MAX_SIZE, config.IMAGE_PREVIEW_SIZE,
+                       config.IMAGE_FORMAT, config.IMAGE_QUALITY)
+        processed = cache.get(key)
+        if processed is None:
+            processed = preprocess_image(
+                image_bytes,
+                digest,
+                max_size=config.IMAGE_MAX_SIZE,
+                preview_size=config.IMAGE_PREVIEW_SIZE,
+                fmt=config.IMAGE_FORMAT,
+                quality=config.IMAGE_QUALITY
+            )
+            cache.set(key, processed)
+        return processed
     except Exception as e:
         st.error(f"❌ Error processing image: {str(e)}")
         return None
 
-def analyze_image_with_gemini(image, equipment_type, context):
-    """Analyze image using Gemini Vision"""
-    try:
-        model = genai.GenerativeModel('gemini-1.5-pro-latest')
-        
-        prompt = f"""
-        Analyze this {equipment_type} image for maintenance issues.
-        
-        Context: {context}
-        
-        Please identify:
-        1. Visible damage, wear, or faults
-        2. Potential safety hazards
-        3. Components that may need repair/replacement
-        4. Any unusual conditions or patterns
-        5. Urgency level (Low/Medium/High/Critical)
-        
-        Provide specific, actionable observations.
-        """
-        
-        response = model.generate_content([prompt, image])
-        return response.text
-        
-    except Exception as e:
-        return f"❌ Image analysis failed: {str(e)}"
-
-# Learning functions (same as before)
-def extract_key_issues(diagnosis_text):
-    """Extract key issues from diagnosis for learning"""
-    issues = []
-    patterns = [
-        r'[Cc]ause[s]?[:\s]+([^\.]+)',
-        r'[Pp]roblem[s]?[:\s]+([^\.]+)',
-        r'[Ii]ssue[s]?[:\s]+([^\.]+)',
-        r'[Ff]ault[s]?[:\s]+([^\.]+)'
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, diagnosis_text)
-        issues.extend(matches)
-    
-    return issues[:3]
-
-def learn_from_case(equipment_type, symptoms, environment, diagnosis_text, severity, has_images=False):
-    """Learn from each case and update patterns"""
-    symptom_key = "_".join(sorted(symptoms)) if symptoms else "no_symptoms"
-    env_key = "_".join(sorted(environment)) if environment else "normal_env"
-    pattern_key = f"{equipment_type}|{symptom_key}|{env_key}"
-    
-    key_issues = extract_key_issues(diagnosis_text)
-    
-    if pattern_key in st.session_state.learned_patterns:
-        st.session_state.learned_patterns[pattern_key]['count'] += 1
-        st.session_state.learned_patterns[pattern_key]['last_used'] = datetime.now().isoformat()
-        
-        if severity in st.session_state.learned_patterns[pattern_key]['severity_dist']:
-            st.session_state.learned_patterns[pattern_key]['severity_dist'][severity] += 1
-        else:
-            st.session_state.learned_patterns[pattern_key]['severity_dist'][severity] = 1
-            
-        for issue in key_issues:
-            if issue not in st.session_state.learned_patterns[pattern_key]['common_issues']:
-                st.session_state.learned_patterns[pattern_key]['common_issues'].append(issue)
-                
-        # Track if images were useful
-        if has_images:
-            st.session_state.learned_patterns[pattern_key]['has_images'] = True
-                
-    else:
-        st.session_state.learned_patterns[pattern_key] = {
-            'count': 1,
-            'equipment_type': equipment_type,
-            'symptoms': symptoms,
-            'environment': environment,
-            'common_issues': key_issues,
-            'severity_dist': {severity: 1},
-            'first_seen': datetime.now().isoformat(),
-            'last_used': datetime.now().isoformat(),
-            'has_images': has_images
-        }
-    
-    if equipment_type in st.session_state.equipment_insights:
-        st.session_state.equipment_insights[equipment_type]['total_cases'] += 1
-        st.session_state.equipment_insights[equipment_type]['common_symptoms'].extend(symptoms)
-        if has_images:
-            st.session_state.equipment_insights[equipment_type]['cases_with_images'] = st.session_state.equipment_insights[equipment_type].get('cases_with_images', 0) + 1
-    else:
-        st.session_state.equipment_insights[equipment_type] = {
-            'total_cases': 1,
-            'common_symptoms': symptoms,
-            'first_case': datetime.now().isoformat(),
-            'cases_with_images': 1 if has_images else 0
-        }
+def queue_image_analyses(images, equipment_type, severity, start=True):
+    """Return (state, analysis) per image without blocking, queueing missing analyses when start.
 
+    Jobs this session queued earlier for uploads that have since been
+    removed, or for a different equipment type/severity, are cancelled
+    if they have not started yet.
+    """
+    queue = get_analysis_queue()
+    context = f"Equipment: {equipment_type}, Severity: {severity}"
+    keys = set()
+    statuses = []
+    for image in images:
+        key = image_analysis_key(image.digest, equipment_type, severity)
+        keys.add(key)
+        state, analysis = queue.lookup(key)
+        if state is None and start:
+            queue.submit(key, image, equipment_type, context)
+            state = "pending"
+        statuses.append((state, analysis))
+    for key in st.session_state.analysis_keys - keys:
+        queue.cancel(key)
+    st.session_state.analysis_keys = keys
+    return statuses
+
+# Learning functions, backed by the shared knowledge base
 def get_learned_insights(equipment_type, symptoms, environment):
     """Get relevant insights from learned patterns"""
-    relevant_patterns = []
-    symptom_key = "_".join(sorted(symptoms)) if symptoms else "no_symptoms"
-    env_key = "_".join(sorted(environment)) if environment else "normal_env"
-    
-    for pattern_key, pattern_data in st.session_state.learned_patterns.items():
-        if pattern_data['equipment_type'] == equipment_type:
-            symptom_similarity = len(set(symptoms) & set(pattern_data['symptoms'])) if symptoms else 0
-            env_similarity = len(set(environment) & set(pattern_data['environment'])) if environment else 0
-            
-            if symptom_similarity > 0 or env_similarity > 0:
-                pattern_data['similarity_score'] = symptom_similarity + env_similarity
-                relevant_patterns.append(pattern_data)
-    
-    relevant_patterns.sort(key=lambda x: (x['similarity_score'], x['count']), reverse=True)
-    return relevant_patterns[:2]
-
-def enhance_prompt_with_learning(base_prompt, equipment_type, symptoms, environment, image_analysis=None):
-    """Enhance the AI prompt with learned insights"""
-    insights = get_learned_insights(equipment_type, symptoms, environment)
-    
-    learning_section = ""
-    if insights:
-        learning_section = "\n\n🎯 **LEARNED INSIGHTS FROM SIMILAR CASES:**\n"
-        for i, insight in enumerate(insights, 1):
-            learning_section += f"""
-            Pattern #{i} (Seen {insight['count']} times):
-            • Common Issues: {', '.join(insight['common_issues'][:3])}
-            • Typical Severity: {max(insight['severity_dist'].items(), key=lambda x: x[1])[0]}
-            • Similar Symptoms: {', '.join(insight['symptoms'])}
-            """
-        learning_section += "\nConsider these patterns in your analysis."
-    
-    # Add image analysis if available
-    image_section = ""
-    if image_analysis:
-        image_section = f"\n\n📷 **IMAGE ANALYSIS RESULTS:**\n{image_analysis}\n\nIntegrate these visual observations with the text description."
-    
-    return base_prompt + learning_section + image_section
+    return get_knowledge_base().get_learned_insights(equipment_type, symptoms, environment, k=2)
+
+# Diagnosis jobs: run on the shared pool, rendered by whichever run of the session is current
+def current_job_id():
+    """The diagnosis job this session is showing; after a reload it is recovered from the URL"""
+    if 'current_job' not in st.session_state:
+        st.session_state.current_job = st.experimental_get_query_params().get("job", [None])[0]
+    return st.session_state.current_job
+
+def set_current_job(job_id):
+    st.session_state.current_job = job_id
+    if job_id:
+        st.experimental_set_query_params(job=job_id)
+    else:
+        st.experimental_set_query_params()
+
+def show_diagnosis_job(job_id, stream_diagnosis):
+    """Render a diagnosis job, polling until it finishes.
+
+    A rerun interrupts the polling, not the job: the next run picks it
+    up again from the shared pool or, once finished, from the store.
+    """
+    jobs = get_diagnosis_jobs()
+    job = jobs.status(job_id)
+    if job is None:
+        set_current_job(None)
+        return
+    
+    if job['status'] not in FINISHED_STATES:
+        spinner_text = "🔍 AI is analyzing the issue..." if stream_diagnosis else "🔍 AI is analyzing the issue... This may take 30-45 seconds"
+        with st.spinner(spinner_text):
+            status_placeholder = st.empty()
+            stream_placeholder = st.empty()
+            # Poll quickly at first so cached or short diagnoses show at once, then back off
+            poll_seconds = 0.05
+            while job['status'] not in FINISHED_STATES:
+                status_placeholder.caption(
+                    f"⏳ {job['stage']}... ({time.time() - job['submitted_at']:.0f}s) - "
+                    "the diagnosis keeps running if you change the form or reload the page"
+                )
+                if job.get('partial'):
+                    stream_placeholder.markdown(job['partial'] + " ▌")
+                time.sleep(poll_seconds)
+                poll_seconds = min(2 * poll_seconds, config.JOB_POLL_INTERVAL_MS / 1000)
+                job = jobs.status(job_id)
+            # The full report is rendered below alongside the summary
+            status_placeholder.empty()
+            stream_placeholder.empty()
+    
+    if job['status'] == FAILED:
+        if job['error_type'] in (CircuitOpenError.__name__, RateLimitTimeout.__name__):
+            st.warning(f"⏳ The AI service is busy: {job['error']}. Please try again shortly.")
+        else:
+            st.error(f"❌ Analysis failed: {job['error']}")
+            st.info("💡 Tip: Check your API key and try again. If issues persist, the AI service might be temporarily unavailable.")
+        return
+    
+    result = job['result']
+    case_data = result['case']
+    diagnosis_text = case_data['diagnosis']
+    structured = case_data['structured']
+    first_view = job_id not in st.session_state.collected_jobs
+    if first_view:
+        st.session_state.collected_jobs.add(job_id)
+        st.session_state.diagnosis_history.append(case_data)
+        st.session_state.last_prompt_report = result['prompt_report']
+    
+    # Display results
+    st.success("✅ Diagnosis Complete!")
+    if result['served_from_cache']:
+        st.info("⚡ An identical case was diagnosed recently, so the cached diagnosis was reused. Tick \"Bypass Diagnosis Cache\" for a fresh one.")
+    if first_view:
+        st.balloons()
+    
+    # Results header with metrics
+    st.subheader("📊 Diagnosis Summary")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Equipment", case_data['equipment_type'])
+    with col2:
+        st.metric("Severity", case_data['severity'], delta=None)
+    with col3:
+        st.metric("Urgency", case_data['urgency'])
+    with col4:
+        st.metric("Images Used", case_data['images_count'])
+    
+    # Show learning impact
+    if result['learning_applied']:
+        st.success("🧠 **AI Learning Applied**: This diagnosis was enhanced with insights from similar historical cases!")
+    
+    if case_data['has_images']:
+        st.success("🖼️ **Image Analysis Integrated**: Visual evidence was incorporated into the diagnosis!")
+    
+    # Detailed analysis
+    st.markdown("---")
+    st.subheader("🔬 Detailed Analysis & Recommendations")
+    st.markdown(diagnosis_text)
+    
+    if structured:
+        with st.expander("🧾 Structured Summary", expanded=False):
+            if structured['urgency']:
+                st.markdown(f"**AI-Assessed Urgency**: {structured['urgency']}")
+            for title, field in (("Root Causes", 'root_causes'), ("Parts", 'parts'),
+                                 ("Repair Steps", 'steps'), ("Safety", 'safety')):
+                if structured[field]:
+                    st.markdown(f"**{title}**\n" + "\n".join(f"- {item}" for item in structured[field]))
+    
+    # Quick actions
+    st.markdown("---")
+    st.subheader("🚀 Quick Actions")
+    action_col1, action_col2, action_col3 = st.columns(3)
+    
+    with action_col1:
+        if st.button("📋 Save to History", use_container_width=True):
+            st.success("✅ Case saved to history!")
+    
+    with action_col2:
+        st.download_button(
+            label="📄 Export Report",
+            data=diagnosis_text,
+            file_name=f"insightflow_diagnosis_{case_data['id']}.txt",
+            mime="text/plain",
+            use_container_width=True
+        )
+    
+    with action_col3:
+        if st.button("🆕 New Diagnosis", use_container_width=True):
+            set_current_job(None)
+            st.rerun()
 
 # Main application tabs
 tab1, tab2, tab3, tab4 = st.tabs(["🔍 New Diagnosis", "📋 Case History", "🧠 AI Learning", "⚙️ Settings"])
@@ -251,6 +298,10 @@ with tab1:
         help="Upload clear photos showing the issue, damage, or overall equipment condition"
     )
     
+    # Multimodal diagnoses send the photos with the diagnosis call itself, so photos are
+    # not analyzed one by one first; the toggle below is read from the previous run
+    multimodal_diagnosis = st.session_state.get("multimodal_diagnosis", config.DIAGNOSIS_MODE == "multimodal")
+    
     # Process and display uploaded images
     st.session_state.uploaded_images = []
     image_analysis_results = []
@@ -259,24 +310,53 @@ with tab1:
         st.subheader("📸 Uploaded Images")
         cols = st.columns(min(3, len(uploaded_files)))
         
+        analysis_slots = {}
+        images_to_analyze = []
         for i, uploaded_file in enumerate(uploaded_files):
             with cols[i % 3]:
-                st.image(uploaded_file, caption=f"Image {i+1}", use_column_width=True)
                 processed_image = process_uploaded_image(uploaded_file)
                 if processed_image:
+                    st.image(processed_image.preview, caption=f"Image {i+1}", use_column_width=True)
                     st.session_state.uploaded_images.append(processed_image)
-                    
-                    # Quick image analysis
-                    with st.spinner(f"🔍 Analyzing image {i+1}..."):
-                        analysis = analyze_image_with_gemini(
-                            processed_image, 
-                            equipment_type,
-                            f"Equipment: {equipment_type}, Severity: {severity}"
-                        )
-                        image_analysis_results.append(analysis)
-                        
-                    with st.expander(f"📊 Image {i+1} Analysis"):
-                        st.write(analysis)
+                    placeholder = st.empty()
+                    analysis_slots[len(images_to_analyze)] = (i, placeholder)
+                    images_to_analyze.append(processed_image)
+        
+        def show_analysis(slot, analysis):
+            image_number, placeholder = analysis_slots[slot]
+            with placeholder.container():
+                with st.expander(f"📊 Image {image_number+1} Analysis"):
+                    st.write(analysis)
+        
+        if config.IMAGE_ANALYSIS_MODE == "inline" and not multimodal_diagnosis:
+            # Quick image analysis, filled into each image's slot as it completes
+            for image_number, placeholder in analysis_slots.values():
+                placeholder.info(f"🔍 Analyzing image {image_number+1}...")
+            ordered_results = [None] * len(images_to_analyze)
+            for slot, analysis in analyze_images_concurrently(images_to_analyze, equipment_type, severity,
+                                                                  get_analysis_queue()):
+                ordered_results[slot] = analysis
+                show_analysis(slot, analysis)
+            image_analysis_results = ordered_results
+        else:
+            # Deferred: queue the analyses and show whatever has finished so far; the
+            # rest is picked up on later reruns or awaited when a diagnosis is requested
+            statuses = queue_image_analyses(images_to_analyze, equipment_type, severity,
+                                            start=analyze_on_upload(multimodal_diagnosis))
+            for slot, (state, analysis) in enumerate(statuses):
+                image_number, placeholder = analysis_slots[slot]
+                if state in ("done", "failed"):
+                    show_analysis(slot, analysis)
+                elif state == "pending":
+                    placeholder.info(f"⏳ Image {image_number+1} is being analyzed in the background - keep filling in the form")
+                elif multimodal_diagnosis:
+                    placeholder.caption(f"🖼️ Image {image_number+1} will be sent with the diagnosis request")
+                else:
+                    placeholder.caption(f"🕒 Image {image_number+1} will be analyzed when you request the diagnosis")
+            if any(state == "pending" for state, _ in statuses):
+                st.button("🔄 Check image analysis", help="Show background analyses that have finished since the last update")
+    else:
+        queue_image_analyses([], equipment_type, severity)
 
     # Enhanced issue description
     st.subheader("📝 Issue Description")
@@ -338,175 +418,217 @@ with tab1:
 
     # Expert mode toggle
     st.session_state.expert_mode = st.checkbox("🔬 Expert Mode (Detailed Technical Analysis)")
+    stream_diagnosis = st.checkbox(
+        "⚡ Stream Diagnosis (show results as they are written)",
+        value=True,
+        help="Renders the diagnosis progressively instead of waiting for the full report"
+    )
+    bypass_diagnosis_cache = st.checkbox(
+        "♻️ Bypass Diagnosis Cache",
+        help="Always request a fresh diagnosis, even if an identical case was answered recently"
+    )
+    st.checkbox(
+        "🖼️ Single-Call Image Diagnosis",
+        value=config.DIAGNOSIS_MODE == "multimodal",
+        key="multimodal_diagnosis",
+        help="Send the photos with the diagnosis request in one model call instead of analyzing each photo first"
+    )
 
-    # Process diagnosis
+    # Process diagnosis: the job runs on the shared pool, so reruns and reloads don't lose it
     if st.button("🚀 Get AI Diagnosis", type="primary", use_container_width=True):
         if not api_key:
             st.error("❌ Please enter your Google AI Studio API Key in the sidebar")
         elif not issue_description.strip():
             st.error("❌ Please describe the issue")
         else:
-            with st.spinner("🔍 AI is analyzing the issue... This may take 30-45 seconds"):
-                try:
-                    model = genai.GenerativeModel('gemini-1.5-pro-latest')
-                    
-                    # Combine image analyses
-                    combined_image_analysis = ""
-                    if image_analysis_results:
-                        combined_image_analysis = "IMAGE ANALYSIS SUMMARY:\n" + "\n".join([f"Image {i+1}: {analysis}" for i, analysis in enumerate(image_analysis_results)])
-                    
-                    # Enhanced prompt for better diagnosis
-                    base_prompt = f"""
-                    MAINTENANCE DIAGNOSIS REQUEST
-
-                    EQUIPMENT: {equipment_type}
-                    SEVERITY: {severity}
-                    URGENCY: {urgency}
-                    ENVIRONMENT: {', '.join(environment) if environment else 'Normal'}
-                    SYMPTOMS: {', '.join(symptoms) if symptoms else 'Not specified'}
-                    IMAGES UPLOADED: {len(uploaded_files)} image(s)
-
-                    ISSUE DESCRIPTION:
-                    {issue_description}
-                    """
-                    
-                    # Enhance prompt with learned insights and image analysis
-                    enhanced_prompt = enhance_prompt_with_learning(
-                        base_prompt, equipment_type, symptoms, environment, combined_image_analysis
-                    )
-                    
-                    if st.session_state.expert_mode:
-                        prompt = enhanced_prompt + """
-                        As an expert maintenance engineer with 20+ years of experience, provide a COMPREHENSIVE technical analysis:
-
-                        1. INTEGRATED ANALYSIS:
-                           - Combine visual evidence from images with described symptoms
-                           - Root cause identification considering all available data
-                           - Failure mechanism analysis
-
-                        2. TECHNICAL DIAGNOSIS:
-                           - Step-by-step verification procedure
-                           - Required diagnostic tools and measurements
-                           - Correlation between visual signs and performance issues
-
-                        3. REPAIR PROCEDURE:
-                           - Detailed step-by-step instructions
-                           - Required tools and equipment
-                           - Replacement parts with specifications
-                           - Integration of visual findings with repair steps
-
-                        4. SAFETY PROTOCOLS:
-                           - Lockout/tagout requirements
-                           - Personal protective equipment
-                           - Hazardous material handling
-                           - Emergency procedures
-
-                        5. TIME & COST ESTIMATION:
-                           - Labor hours breakdown
-                           - Parts cost estimation
-                           - Total repair timeline
-
-                        6. PREVENTION & MAINTENANCE:
-                           - Preventive maintenance schedule
-                           - Visual inspection guidelines
-                           - Early warning signs
-                           - Spare parts recommendation
-
-                        Format with clear technical headings and bullet points.
-                        Integrate image findings throughout your analysis.
-                        """
-                    else:
-                        prompt = enhanced_prompt + """
-                        As a maintenance expert, provide a clear and practical diagnosis:
-
-                        1. COMBINED ASSESSMENT: Integrate image findings with described issues
-                        2. LIKELY CAUSE: What's probably wrong based on all evidence
-                        3. QUICK CHECKS: Simple things to verify first  
-                        4. REPAIR STEPS: Step-by-step fix incorporating visual clues
-                        5. TOOLS NEEDED: What you'll need
-                        6. SAFETY FIRST: Important warnings
-                        7. TIME & COST: Rough estimates
-                        8. PREVENTION: How to avoid future issues
-
-                        Use simple language and focus on actionable steps.
-                        Reference image findings where relevant.
-                        """
-                    
-                    response = model.generate_content(prompt)
-                    
-                    # Store case data
-                    case_data = {
-                        'id': len(st.session_state.diagnosis_history) + 1,
-                        'timestamp': datetime.now().isoformat(),
-                        'equipment_type': equipment_type,
-                        'severity': severity,
-                        'urgency': urgency,
-                        'symptoms': symptoms,
-                        'environment': environment,
-                        'issue_description': issue_description,
-                        'diagnosis': response.text,
-                        'expert_mode': st.session_state.expert_mode,
-                        'images_count': len(uploaded_files),
-                        'has_images': len(uploaded_files) > 0
-                    }
-                    st.session_state.diagnosis_history.append(case_data)
-                    
-                    # Learn from this case
-                    learn_from_case(equipment_type, symptoms, environment, response.text, severity, len(uploaded_files) > 0)
-                    
-                    # Display results
-                    st.success("✅ Diagnosis Complete!")
-                    st.balloons()
-                    
-                    # Results header with metrics
-                    st.subheader("📊 Diagnosis Summary")
-                    
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric("Equipment", equipment_type)
-                    with col2:
-                        st.metric("Severity", severity, delta=None)
-                    with col3:
-                        st.metric("Urgency", urgency)
-                    with col4:
-                        st.metric("Images Used", len(uploaded_files))
-                    
-                    # Show learning impact
-                    if get_learned_insights(equipment_type, symptoms, environment):
-                        st.success("🧠 **AI Learning Applied**: This diagnosis was enhanced with insights from similar historical cases!")
-                    
-                    if uploaded_files:
-                        st.success("🖼️ **Image Analysis Integrated**: Visual evidence was incorporated into the diagnosis!")
-                    
-                    # Detailed analysis
-                    st.markdown("---")
-                    st.subheader("🔬 Detailed Analysis & Recommendations")
-                    st.markdown(response.text)
-                    
-                    # Quick actions
-                    st.markdown("---")
-                    st.subheader("🚀 Quick Actions")
-                    action_col1, action_col2, action_col3 = st.columns(3)
-                    
-                    with action_col1:
-                        if st.button("📋 Save to History", use_container_width=True):
-                            st.success("✅ Case saved to history!")
-                    
-                    with action_col2:
-                        st.download_button(
-                            label="📄 Export Report",
-                            data=response.text,
-                            file_name=f"insightflow_diagnosis_{case_data['id']}.txt",
-                            mime="text/plain",
-                            use_container_width=True
-                        )
-                    
-                    with action_col3:
-                        if st.button("🆕 New Diagnosis", use_container_width=True):
-                            st.rerun()
-                            
-                except Exception as e:
-                    st.error(f"❌ Analysis failed: {str(e)}")
-                    st.info("💡 Tip: Check your API key and try again. If issues persist, the AI service might be temporarily unavailable.")
+            set_current_job(get_diagnosis_jobs().submit({
+                'case': {
+                    'equipment_type': equipment_type,
+                    'severity': severity,
+                    'urgency': urgency,
+                    'environment': environment,
+                    'symptoms': symptoms,
+                    'images_count': len(uploaded_files),
+                    'issue_description': issue_description
+                },
+                'images': list(st.session_state.uploaded_images),
+                # Deferred analyses are joined by the job; inline ones were finished above
+                'image_analysis_results': None if uploaded_files and config.IMAGE_ANALYSIS_MODE != "inline" else image_analysis_results,
+                'multimodal': multimodal_diagnosis,
+                'expert_mode': st.session_state.expert_mode,
+                'stream': stream_diagnosis,
+                'bypass_cache': bypass_diagnosis_cache
+            }))
+    
+    # The current diagnosis job is shown below, at the end of the run
+
+# Learning and metrics tabs read shared state and have their own widgets, so where
+# fragments are available an interaction there reruns only that tab
+@fragment
+def learning_tab():
+    """Statistics learned from past cases, per equipment type"""
+    st.header("🧠 AI Learning")
+    equipment_summaries = get_knowledge_base().equipment_summaries()
+    
+    if equipment_summaries:
+        ranked_equipment = sorted(equipment_summaries, key=lambda name: -equipment_summaries[name]['total_cases'])
+        st.table([
+            {
+                "Equipment": name,
+                "Cases": equipment_summaries[name]['total_cases'],
+                "With Images": equipment_summaries[name]['cases_with_images'],
+                "Most Common Symptoms": ", ".join(
+                    f"{symptom} ({count})" for symptom, count in equipment_summaries[name]['common_symptoms']
+                ) or "—",
+                "Learning Since": equipment_summaries[name]['first_case'][:10]
+            }
+            for name in ranked_equipment
+        ])
+        
+        st.subheader("🔁 Most Frequent Patterns")
+        learning_equipment = st.selectbox("Equipment", ranked_equipment, key="learning_equipment")
+        for pattern in get_knowledge_base().top_patterns(learning_equipment):
+            image_info = " 📷" if pattern['has_images'] else ""
+            st.info(f"""
+            **{', '.join(pattern['symptoms']) or 'No symptoms recorded'}** in {', '.join(pattern['environment']) or 'a normal environment'}: seen **{pattern['count']} times**{image_info}
+            **Most Common Issues**: {', '.join(pattern['common_issues'][:3]) or 'None extracted yet'}
+            **Most Common Parts**: {', '.join(pattern['common_parts'][:3]) or 'None recorded yet'}
+            **Typical Severity**: {max(pattern['severity_dist'].items(), key=lambda x: x[1])[0]}
+            """)
+    else:
+        st.info("Nothing learned yet - every completed diagnosis adds to these statistics.")
+
+with tab3:
+    learning_tab()
+
+@fragment
+def metrics_tab():
+    """Model-call latency, errors and cache hit rates for this server process"""
+    st.header("📈 Model Call Metrics")
+    metrics_summary = get_metrics().summary()
+    
+    if metrics_summary['calls']:
+        def _fmt_seconds(value):
+            return "—" if value is None else f"{value:.2f}s"
+        
+        st.table([
+            {
+                "Call": kind,
+                "Calls": stats['calls'],
+                "Errors": stats['errors'],
+                "p50": _fmt_seconds(stats['wall_p50']),
+                "p95": _fmt_seconds(stats['wall_p95']),
+                "p99": _fmt_seconds(stats['wall_p99']),
+                "TTFT p50": _fmt_seconds(stats['ttft_p50']),
+                "TTFT p95": _fmt_seconds(stats['ttft_p95']),
+                "Prompt tokens": format_tokens(stats['prompt_tokens']),
+                "Response tokens": format_tokens(stats['response_tokens']),
+                "Avg prompt chars": int(stats['avg_prompt_chars']),
+                "Image bytes": stats['payload_bytes']
+            }
+            for kind, stats in metrics_summary['calls'].items()
+        ])
+    else:
+        st.info("No model calls recorded yet in this server process.")
+    
+    if metrics_summary['errors'] or metrics_summary['retries']:
+        err_col, retry_col = st.columns(2)
+        with err_col:
+            st.subheader("❌ Failures by Error Class")
+            st.json(metrics_summary['errors'])
+        with retry_col:
+            st.subheader("🔁 Retries by Error Class")
+            st.json(metrics_summary['retries'])
+    
+    st.subheader("⚡ Cache Hit Rates")
+    st.table([
+        {"Cache": name, "Hits": stats['hits'], "Misses": stats['misses'], "Hit rate": f"{stats['hit_rate']:.0%}", "Entries": stats['entries']}
+        for name, stats in metrics_summary['caches'].items()
+    ])
+    
+    export_col1, export_col2 = st.columns(2)
+    with export_col1:
+        st.download_button(
+            label="📤 Export Prometheus Metrics",
+            data=get_metrics().prometheus_text(),
+            file_name="insightflow_metrics.prom",
+            mime="text/plain",
+            use_container_width=True
+        )
+    with export_col2:
+        st.download_button(
+            label="📤 Export Recent Calls (JSONL)",
+            data=get_metrics().recent_jsonl(),
+            file_name="insightflow_model_calls.jsonl",
+            mime="application/x-ndjson",
+            use_container_width=True
+        )
+
+@fragment
+def transfer_section():
+    """Bulk export of the knowledge base to a compressed archive, and import from one"""
+    st.subheader("🗄️ Knowledge Base Transfer")
+    export_col, import_col = st.columns(2)
+    with export_col:
+        formats = ["JSONL (gzip)"] + (["Parquet"] if parquet_available() else [])
+        export_format = st.radio("Archive format", formats, horizontal=True)
+        if st.button("📦 Prepare Export", use_container_width=True):
+            parquet = export_format == "Parquet"
+            # Records are compressed chunk by chunk; only the finished archive is held for the download
+            archive_file = BytesIO()
+            with st.spinner("Writing the archive..."):
+                counts = export_archive(get_knowledge_base(), archive_file, parquet)
+            st.caption(f"{counts.get('case', 0)} cases · {counts.get('pattern', 0)} patterns · "
+                       f"{counts.get('equipment_insight', 0)} equipment types")
+            st.download_button(
+                label="📥 Download Archive",
+                data=archive_file,
+                file_name="insightflow_knowledge.parquet" if parquet else "insightflow_knowledge.jsonl.gz",
+                mime="application/octet-stream" if parquet else "application/gzip",
+                use_container_width=True
+            )
+    with import_col:
+        archive_upload = st.file_uploader("Archive to import", type=["gz", "parquet"], key="archive_upload",
+                                          help="Cases are added to this knowledge base; patterns and statistics are merged")
+        if archive_upload is not None and st.button("📤 Import Archive", use_container_width=True):
+            try:
+                with st.spinner("Importing..."):
+                    counts = import_archive(get_knowledge_base(), archive_upload, is_parquet(archive_upload.name))
+            except (KeyError, OSError, RuntimeError, ValueError) as e:
+                st.error(f"❌ Import failed: {str(e)}")
+            else:
+                st.success(f"✅ Imported {counts['case']} cases, {counts['pattern']} patterns and "
+                           f"{counts['equipment_insight']} equipment types")
+
+with tab4:
+    metrics_tab()
+    transfer_section()
+
+# Sidebar image cache counter, rendered after the tabs so it reflects this run
+analysis_stats = get_analysis_cache().stats()
+cache_stats_placeholder.metric(
+    "Image Cache Hits",
+    f"{analysis_stats['hits']} / {analysis_stats['hits'] + analysis_stats['misses']}",
+    help=f"Hit rate {analysis_stats['hit_rate']:.0%} · {analysis_stats['entries']} cached analyses · {analysis_stats['disk_hits']} served from disk"
+)
+
+# The current diagnosis job is polled last, at the end of the first tab: this run waits
+# in it until the job finishes, so the rest of the page has to be on screen by then
+if current_job_id():
+    with tab1:
+        show_diagnosis_job(current_job_id(), stream_diagnosis)
+
+# Last prompt size, which the job above may just have updated
+prompt_report = st.session_state.get('last_prompt_report')
+if prompt_report:
+    budget_note = f" of {prompt_report['budget']:,}" if prompt_report['budget'] else ""
+    prompt_size_placeholder.metric(
+        "Last Prompt Size",
+        f"{prompt_report['tokens']:,}{budget_note} tokens" + ("" if prompt_report['exact'] else " (est.)"),
+        delta="over budget" if prompt_report['over_budget'] else None,
+        delta_color="inverse",
+        help=f"Trimmed: {', '.join(sorted(set(prompt_report['trimmed']))) or 'nothing'} · "
+             f"{prompt_report['duplicate_findings']} repeated image findings dropped"
+    )
 
 # ... (rest of the tabs remain the same as previous version, just update requirements.txt)
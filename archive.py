@@ -0,0 +1,165 @@
+"""Bulk export and import of the knowledge base as chunked, compressed JSONL or Parquet.
+
+Usage:
+    python archive.py export insightflow-archive.jsonl.gz
+    python archive.py import insightflow-archive.jsonl.gz
+
+An archive holds a header record followed by every equipment insight,
+learned pattern and stored case (see KnowledgeBase.export_records).
+JSONL archives are written as one gzip member per chunk of records, so
+each chunk can be written or sent as soon as it is ready and the file
+still reads as a single .jsonl.gz. Archives ending in .parquet are
+written with pyarrow, one row group per chunk, when it is installed.
+Importing merges into the target knowledge base, so restoring into an
+empty database reproduces the exported one. The target may be the
+database of a running app: imported cases get their own IDs and pattern
+counts are added to the stored ones, and the app shows them after it
+restarts (imports from the Settings tab show up straight away).
+"""
+import argparse
+import contextlib
+import gzip
+import importlib.util
+import json
+import sys
+from datetime import datetime
+
+import config
+from knowledge import KnowledgeBase
+from storage import KnowledgeStore
+
+ARCHIVE_VERSION = 1
+PARQUET_SUFFIX = ".parquet"
+# Every value in `data` is stored as JSON text, since cases and patterns have no fixed schema
+PARQUET_COLUMNS = ("kind", "key", "data")
+
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def is_parquet(path):
+    return str(path).lower().endswith(PARQUET_SUFFIX)
+
+
+def archive_records(knowledge_base):
+    """The header record followed by knowledge_base.export_records()"""
+    yield {'kind': 'archive', 'key': 'insightflow',
+           'data': {'version': ARCHIVE_VERSION, 'exported_at': datetime.now().isoformat()}}
+    yield from knowledge_base.export_records()
+
+
+def _chunks(records, chunk_records):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_records:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_jsonl_gz(records, chunk_records=config.ARCHIVE_CHUNK_RECORDS):
+    """Yield records as gzip-compressed JSONL, one complete gzip member per chunk_records records"""
+    for chunk in _chunks(records, chunk_records):
+        lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in chunk)
+        yield gzip.compress(lines.encode("utf-8"))
+
+
+def read_jsonl_gz(source):
+    """Yield records from a .jsonl.gz path or binary file object, one line at a time"""
+    with gzip.open(source, "rt", encoding="utf-8") as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_parquet(records, destination, chunk_records=config.ARCHIVE_CHUNK_RECORDS):
+    """Write records to a Parquet path or binary file object, one row group per chunk"""
+    if not parquet_available():
+        raise RuntimeError("Parquet archives need pyarrow (pip install pyarrow)")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in PARQUET_COLUMNS])
+    with pq.ParquetWriter(destination, schema, compression="zstd") as writer:
+        for chunk in _chunks(records, chunk_records):
+            writer.write_table(pa.table({
+                'kind': [record['kind'] for record in chunk],
+                'key': [record['key'] for record in chunk],
+                'data': [json.dumps(record['data'], separators=(",", ":")) for record in chunk],
+            }, schema=schema))
+
+
+def read_parquet(source, chunk_records=config.ARCHIVE_CHUNK_RECORDS):
+    """Yield records from a Parquet path or binary file object, one batch at a time"""
+    if not parquet_available():
+        raise RuntimeError("Parquet archives need pyarrow (pip install pyarrow)")
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_records, columns=list(PARQUET_COLUMNS)):
+        columns = batch.to_pydict()
+        for kind, key, data in zip(columns['kind'], columns['key'], columns['data']):
+            yield {'kind': kind, 'key': key, 'data': json.loads(data)}
+
+
+def export_archive(knowledge_base, destination, parquet=False, chunk_records=config.ARCHIVE_CHUNK_RECORDS):
+    """Stream the knowledge base to a path or binary file object; returns {kind: count}"""
+    counts = {}
+
+    def counted(records):
+        for record in records:
+            counts[record['kind']] = counts.get(record['kind'], 0) + 1
+            yield record
+
+    records = counted(archive_records(knowledge_base))
+    if parquet:
+        write_parquet(records, destination, chunk_records)
+    else:
+        opened = open(destination, "wb") if isinstance(destination, str) else contextlib.nullcontext(destination)
+        with opened as out:
+            for chunk in iter_jsonl_gz(records, chunk_records):
+                out.write(chunk)
+    counts.pop('archive', None)
+    return counts
+
+
+def import_archive(knowledge_base, source, parquet=False, chunk_records=config.ARCHIVE_CHUNK_RECORDS):
+    """Merge an archive from a path or binary file object into the knowledge base; returns {kind: count}"""
+    records = read_parquet(source, chunk_records) if parquet else read_jsonl_gz(source)
+    header = next(records, None)
+    if header is None or header.get('kind') != 'archive':
+        raise ValueError("Not an InsightFlow archive")
+    if header['data'].get('version', 0) > ARCHIVE_VERSION:
+        raise ValueError(f"Archive version {header['data']['version']} is newer than this release supports")
+    return knowledge_base.import_records(records, chunk_size=chunk_records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import the InsightFlow knowledge base")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("path", help=f"archive file: .jsonl.gz, or {PARQUET_SUFFIX} (needs pyarrow)")
+    parser.add_argument("--db", default=config.KNOWLEDGE_DB_PATH,
+                        help="knowledge base to read or update (the app's by default; safe while it runs)")
+    parser.add_argument("--chunk-records", type=int, default=config.ARCHIVE_CHUNK_RECORDS,
+                        help="records per compressed chunk or Parquet row group")
+    args = parser.parse_args(argv)
+
+    if is_parquet(args.path) and not parquet_available():
+        parser.error("Parquet archives need pyarrow (pip install pyarrow)")
+    store = KnowledgeStore(args.db, batch_size=config.KNOWLEDGE_WRITE_BATCH)
+    knowledge_base = KnowledgeBase(store, retrieval_dimensions=config.RETRIEVAL_DIMENSIONS)
+    try:
+        if args.action == "export":
+            counts = export_archive(knowledge_base, args.path, is_parquet(args.path), args.chunk_records)
+        else:
+            counts = import_archive(knowledge_base, args.path, is_parquet(args.path), args.chunk_records)
+    finally:
+        store.close()
+    print(json.dumps(counts), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
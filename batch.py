@@ -0,0 +1,317 @@
+"""Batch diagnosis for CSV/JSONL work-order exports.
+
+Usage:
+    python batch.py work_orders.csv -o diagnoses.jsonl --concurrency 4 --rpm 60
+
+Each input row needs an issue description and may carry equipment_type,
+severity, urgency, symptoms, environment and image_paths (list fields
+are ';'-separated in CSV, arrays or ';'-separated strings in JSONL).
+Results are appended to the output JSONL as they complete; rerunning
+with the same output file skips cases that already succeeded.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import config
+from budget import PromptAssembler
+from cache import ResultCache, make_key
+from gemini_client import GeminiClient
+from imaging import preprocess_image
+from knowledge import KnowledgeBase
+from metrics import MetricsRegistry
+from prompts import build_diagnosis_contents, build_image_analysis_prompt
+from storage import KnowledgeStore
+from structured import split_structured_diagnosis
+
+LIST_FIELDS = ('symptoms', 'environment', 'image_paths')
+FIELD_ALIASES = {
+    'issue_description': ('issue_description', 'description'),
+    'case_id': ('case_id', 'work_order', 'id'),
+}
+
+
+def _split_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value).split(';') if item.strip()]
+
+
+def _first(raw, names):
+    for name in names:
+        value = raw.get(name)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def normalize_case(raw, row_number, base_dir):
+    """Map one input row onto the case fields the diagnosis prompt expects"""
+    description = _first(raw, FIELD_ALIASES['issue_description'])
+    if not description or not str(description).strip():
+        raise ValueError(f"row {row_number}: missing issue description")
+    case = {
+        'case_id': str(_first(raw, FIELD_ALIASES['case_id']) or f"row-{row_number}"),
+        'equipment_type': raw.get('equipment_type') or 'Other',
+        'severity': raw.get('severity') or 'Medium',
+        'urgency': raw.get('urgency') or 'Soon',
+        'issue_description': str(description).strip(),
+    }
+    for field in LIST_FIELDS:
+        case[field] = _split_list(raw.get(field))
+    case['image_paths'] = [
+        path if os.path.isabs(path) else os.path.join(base_dir, path)
+        for path in case['image_paths']
+    ]
+    case['images_count'] = len(case['image_paths'])
+    return case
+
+
+def _decode_row(line, row_number):
+    try:
+        raw = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"row {row_number}: invalid JSON ({e})") from None
+    if not isinstance(raw, dict):
+        raise ValueError(f"row {row_number}: expected a JSON object")
+    return raw
+
+
+def read_cases(path, log=sys.stderr):
+    """Yield normalized cases from a CSV or JSONL file without loading it whole"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jsonl = path.lower().endswith(('.jsonl', '.ndjson', '.json'))
+    with open(path, newline='', encoding='utf-8') as fh:
+        if jsonl:
+            # Decoded per row below, so one malformed line is skipped like any other bad row
+            rows = (line for line in fh if line.strip())
+        else:
+            rows = csv.DictReader(fh)
+        for row_number, raw in enumerate(rows, 1):
+            try:
+                if jsonl:
+                    raw = _decode_row(raw, row_number)
+                yield normalize_case(raw, row_number, base_dir)
+            except ValueError as e:
+                print(f"[skip] {e}", file=log)
+
+
+def completed_case_ids(output_path):
+    """Case IDs already diagnosed successfully in a previous run"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'ok':
+                done.add(record['case_id'])
+    return done
+
+
+def load_images(paths):
+    """Read and preprocess a case's image files into ProcessedImages"""
+    images = []
+    for path in paths:
+        with open(path, 'rb') as fh:
+            image_bytes = fh.read()
+        images.append(preprocess_image(
+            image_bytes,
+            make_key(image_bytes),
+            max_size=config.IMAGE_MAX_SIZE,
+            preview_size=config.IMAGE_PREVIEW_SIZE,
+            fmt=config.IMAGE_FORMAT,
+            quality=config.IMAGE_QUALITY
+        ))
+    return images
+
+
+def diagnose_case(client, case, knowledge_base, expert_mode=False, multimodal=False, assembler=None):
+    """Run image analyses and the diagnosis for one case; return the diagnosis text.
+
+    With multimodal=True the images are sent inline with the diagnosis
+    prompt in a single call instead of being analyzed one by one first.
+    assembler is a PromptAssembler shared across cases so its token
+    counts are cached; by default one is built for this case.
+    """
+    assembler = assembler or PromptAssembler(client.count_tokens, config.PROMPT_TOKEN_BUDGET)
+    images = load_images(case['image_paths'])
+    insights = knowledge_base.get_learned_insights(case['equipment_type'], case['symptoms'], case['environment'])
+    similar_cases = knowledge_base.similar_cases(
+        case['issue_description'], case['equipment_type'], k=config.RETRIEVAL_TOP_K
+    )
+    if multimodal:
+        prompt, _report = assembler.assemble(case, insights, expert_mode=expert_mode, attached_images=len(images),
+                                             similar_cases=similar_cases,
+                                             structured_output=bool(config.STRUCTURED_DIAGNOSIS))
+        response = client.generate(build_diagnosis_contents(prompt, [image.as_part() for image in images]),
+                                   kind="diagnosis")
+        return response.text
+
+    context = f"Equipment: {case['equipment_type']}, Severity: {case['severity']}"
+    image_analysis_results = []
+    for image in images:
+        response = client.generate([build_image_analysis_prompt(case['equipment_type'], context), image.as_part()],
+                                   kind="image_analysis")
+        image_analysis_results.append(response.text)
+
+    prompt, report = assembler.assemble(case, insights, image_analysis_results, expert_mode=expert_mode,
+                                        similar_cases=similar_cases,
+                                        structured_output=bool(config.STRUCTURED_DIAGNOSIS))
+    response = client.generate(prompt, kind="diagnosis", prompt_tokens=report['tokens'] if report['exact'] else None)
+    return response.text
+
+
+def run_batch(input_path, output_path, concurrency=4, requests_per_minute=60, expert_mode=False,
+              learn=True, max_attempts=5, knowledge_base=None, client=None, multimodal=False, db_path=None,
+              log=sys.stderr):
+    """Diagnose every pending case in input_path, appending results to output_path.
+
+    requests_per_minute and max_attempts configure the GeminiClient built
+    when no client is passed in; db_path picks the knowledge base opened
+    when none is passed in (the app's by default). The store is safe to
+    share with a running app, which shows the new cases and patterns
+    once it restarts.
+    """
+    knowledge_base = knowledge_base or KnowledgeBase(
+        KnowledgeStore(db_path or config.KNOWLEDGE_DB_PATH), retrieval_dimensions=config.RETRIEVAL_DIMENSIONS
+    )
+    client = client or GeminiClient(
+        requests_per_minute=requests_per_minute,
+        burst=concurrency,
+        max_attempts=max_attempts,
+        queue_timeout=None
+    )
+    assembler = PromptAssembler(
+        client.count_tokens, config.PROMPT_TOKEN_BUDGET, ResultCache(max_entries=config.PROMPT_FRAGMENT_CACHE_SIZE)
+    )
+    done = completed_case_ids(output_path)
+    stats = {'ok': 0, 'error': 0, 'skipped': 0}
+    started = time.monotonic()
+
+    def process(case):
+        case_started = time.monotonic()
+        record = {key: value for key, value in case.items() if key != 'images_count'}
+        try:
+            diagnosis_text, structured = split_structured_diagnosis(
+                diagnose_case(client, case, knowledge_base, expert_mode, multimodal, assembler)
+            )
+            record.update(status='ok', diagnosis=diagnosis_text, structured=structured)
+            if learn:
+                case_data = {
+                    'timestamp': datetime.now().isoformat(),
+                    'equipment_type': case['equipment_type'],
+                    'severity': case['severity'],
+                    'urgency': case['urgency'],
+                    'symptoms': case['symptoms'],
+                    'environment': case['environment'],
+                    'issue_description': case['issue_description'],
+                    'diagnosis': diagnosis_text,
+                    'structured': structured,
+                    'expert_mode': expert_mode,
+                    'images_count': case['images_count'],
+                    'has_images': case['images_count'] > 0,
+                    'work_order': case['case_id']
+                }
+                knowledge_base.record_case(case_data)
+                knowledge_base.learn_from_case(
+                    case['equipment_type'], case['symptoms'], case['environment'],
+                    diagnosis_text, case['severity'], case['images_count'] > 0,
+                    issue_description=case['issue_description'], case_id=case_data['id'], structured=structured
+                )
+        except Exception as e:
+            record.update(status='error', error=f"{type(e).__name__}: {e}")
+        record['elapsed_seconds'] = round(time.monotonic() - case_started, 3)
+        record['completed_at'] = datetime.now().isoformat()
+        return record
+
+    window = max(1, concurrency) * 4
+    with open(output_path, 'a', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+
+        def drain(pending, return_when):
+            finished, still_pending = wait(pending, return_when=return_when)
+            for future in finished:
+                record = future.result()
+                stats[record['status']] += 1
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                elapsed = time.monotonic() - started
+                rate = (stats['ok'] + stats['error']) / elapsed * 60 if elapsed else 0.0
+                print(f"[{record['status']}] {record['case_id']} ({record['elapsed_seconds']}s) "
+                      f"- {rate:.1f} cases/min", file=log)
+            return still_pending
+
+        pending = set()
+        for case in read_cases(input_path, log):
+            if case['case_id'] in done:
+                stats['skipped'] += 1
+                continue
+            pending.add(executor.submit(process, case))
+            if len(pending) >= window:
+                pending = drain(pending, FIRST_COMPLETED)
+        while pending:
+            pending = drain(pending, FIRST_COMPLETED)
+
+    knowledge_base.flush()
+    elapsed = time.monotonic() - started
+    processed = stats['ok'] + stats['error']
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    stats['cases_per_minute'] = round(processed / elapsed * 60, 2) if elapsed and processed else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run InsightFlow diagnoses for a CSV/JSONL file of work orders")
+    parser.add_argument("input", help="CSV or JSONL file of cases")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to append results to (also used to resume)")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_CONCURRENCY, help="cases diagnosed in parallel")
+    parser.add_argument("--rpm", type=float, default=config.BATCH_REQUESTS_PER_MINUTE, help="max Gemini requests per minute")
+    parser.add_argument("--max-attempts", type=int, default=5, help="attempts per Gemini call on 429/5xx errors")
+    parser.add_argument("--expert", action="store_true", help="use the expert-mode prompt")
+    parser.add_argument("--multimodal", action="store_true", default=config.DIAGNOSIS_MODE == "multimodal",
+                        help="send images inline with one diagnosis call instead of analyzing each first")
+    parser.add_argument("--no-learn", action="store_true", help="don't record cases or update learned patterns")
+    parser.add_argument("--db", default=config.KNOWLEDGE_DB_PATH,
+                        help="knowledge base to learn from and into (the app's by default)")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY"), help="defaults to $GOOGLE_API_KEY")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("a Google AI Studio API key is required (--api-key or GOOGLE_API_KEY)")
+    metrics = MetricsRegistry(jsonl_path=config.METRICS_JSONL_PATH)
+    client = GeminiClient(
+        requests_per_minute=args.rpm,
+        burst=args.concurrency,
+        max_attempts=args.max_attempts,
+        queue_timeout=None,
+        metrics=metrics
+    )
+    client.configure(args.api_key)
+
+    stats = run_batch(
+        args.input, args.output,
+        concurrency=args.concurrency,
+        expert_mode=args.expert,
+        learn=not args.no_learn,
+        client=client,
+        multimodal=args.multimodal,
+        db_path=args.db
+    )
+    stats['model_calls'] = metrics.summary()['calls']
+    print(json.dumps(stats), file=sys.stderr)
+    return 0 if stats['error'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Local stand-in for google.generativeai.GenerativeModel used by the benchmarks"""
+import contextlib
+import random
+import threading
+import time
+
+import google.generativeai as genai
+
+DEFAULT_TEXT = (
+    "LIKELY CAUSE: Cause: clogged intake filter restricting airflow. "
+    "Problem: fan bearing wear producing noise. "
+    "REPAIR STEPS: isolate power, replace the filter, lubricate or replace the bearing. "
+    "SAFETY FIRST: lockout/tagout before opening the housing.\n\n"
+    "```json\n"
+    '{"root_causes": ["clogged intake filter restricting airflow", "fan bearing wear"], "urgency": "Medium", '
+    '"parts": ["intake filter", "fan bearing"], "steps": ["isolate power", "replace the filter", '
+    '"lubricate or replace the bearing"], "safety": ["lockout/tagout before opening the housing"]}\n'
+    "```"
+)
+
+
+class FakeAPIError(Exception):
+    """Mimics google.api_core errors: carries an HTTP status in `code`"""
+
+    def __init__(self, code, message="injected failure"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FakeTokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+class FakeResponse:
+    """Shaped like a google-generativeai 0.3.2 response, which reports no usage_metadata"""
+
+    def __init__(self, text):
+        self.text = text
+        self.prompt_feedback = None
+
+
+class FakeBackend:
+    """Shared behaviour for every fake model handle: latency, chunking and error injection.
+
+    Tokens received and sent are tallied here, on the "server" side,
+    since the responses themselves carry no usage.
+    """
+
+    def __init__(self, latency=0.05, ttft=None, chunks=8, error_rate=0.0, error_codes=(429, 503),
+                 text=DEFAULT_TEXT, seed=0, image_latency=0.0):
+        self.latency = latency
+        self.image_latency = image_latency
+        self.ttft = latency / 4 if ttft is None else ttft
+        self.chunks = max(1, chunks)
+        self.error_rate = error_rate
+        self.error_codes = error_codes
+        self.text = text
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.failures += 1
+                code = self._random.choice(self.error_codes)
+        if fail:
+            raise FakeAPIError(code)
+
+    @staticmethod
+    def count_prompt_tokens(contents):
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        prompt_tokens = sum(len(part) // 4 for part in parts if isinstance(part, str))
+        return prompt_tokens + 258 * sum(1 for part in parts if isinstance(part, dict))
+
+    def generate(self, contents, stream=False):
+        self._maybe_fail()
+        with self._lock:
+            self.prompt_tokens += self.count_prompt_tokens(contents)
+            self.response_tokens += len(self.text) // 4
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        latency = self.latency + self.image_latency * sum(1 for part in parts if isinstance(part, dict))
+        if not stream:
+            time.sleep(latency)
+            return FakeResponse(self.text)
+        return self._stream(latency)
+
+    def _stream(self, latency):
+        step = max(1, len(self.text) // self.chunks)
+        pieces = [self.text[i:i + step] for i in range(0, len(self.text), step)]
+        gap = max(0.0, latency - self.ttft) / max(1, len(pieces) - 1)
+        time.sleep(self.ttft)
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(gap)
+            yield FakeResponse(piece)
+
+
+class FakeGenerativeModel:
+    """Drop-in for genai.GenerativeModel backed by the installed FakeBackend"""
+
+    backend = FakeBackend()
+
+    def __init__(self, model_name="gemini-fake", safety_settings=None, generation_config=None, tools=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+
+    def generate_content(self, contents, *, generation_config=None, safety_settings=None, stream=False, **kwargs):
+        return self.backend.generate(contents, stream=stream)
+
+    def count_tokens(self, contents):
+        return FakeTokenCount(self.backend.count_prompt_tokens(contents))
+
+
+@contextlib.contextmanager
+def installed(backend=None):
+    """Temporarily replace genai.GenerativeModel with FakeGenerativeModel"""
+    original_model = genai.GenerativeModel
+    original_backend = FakeGenerativeModel.backend
+    FakeGenerativeModel.backend = backend or FakeBackend()
+    genai.GenerativeModel = FakeGenerativeModel
+    try:
+        yield FakeGenerativeModel.backend
+    finally:
+        genai.GenerativeModel = original_model
+        FakeGenerativeModel.backend = original_backend
@@ -0,0 +1,613 @@
+"""Offline benchmarks for InsightFlow against a local Gemini stand-in.
+
+Usage:
+    python benchmarks/run_benchmarks.py -o benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json --tolerance 0.25
+
+Every benchmark runs headlessly with genai.GenerativeModel replaced by
+FakeGenerativeModel, so no API key or network access is needed. Results
+are written as JSON; --compare exits non-zero when a metric regresses
+by more than the tolerance (metrics ending in _seconds are lower-is-better,
+_per_second/_per_minute are higher-is-better).
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="insightflow-bench-")
+# Keep benchmark state away from the real knowledge base and caches
+os.environ.setdefault("INSIGHTFLOW_DB_PATH", os.path.join(WORKDIR, "app.db"))
+os.environ.setdefault("INSIGHTFLOW_DIAGNOSIS_CACHE_DIR", os.path.join(WORKDIR, "diagnoses"))
+os.environ.setdefault("INSIGHTFLOW_GEMINI_RPM", "100000")
+os.environ.setdefault("INSIGHTFLOW_GEMINI_BURST", "1000")
+sys.path.insert(0, ROOT)
+
+from fake_gemini import DEFAULT_TEXT, FakeBackend, installed  # noqa: E402
+
+import config  # noqa: E402
+import resilience  # noqa: E402
+from analysis_queue import AnalysisQueue  # noqa: E402
+from archive import export_archive, import_archive  # noqa: E402
+from batch import diagnose_case  # noqa: E402
+from budget import PromptAssembler  # noqa: E402
+from cache import ResultCache, make_key  # noqa: E402
+from gemini_client import GeminiClient  # noqa: E402
+from imaging import preprocess_image  # noqa: E402
+from knowledge import KnowledgeBase  # noqa: E402
+from metrics import MetricsRegistry, percentile  # noqa: E402
+from pipeline import analyze_image_with_gemini, analyze_on_upload, image_analysis_key, run_diagnosis_job  # noqa: E402
+from prompts import build_diagnosis_prompt  # noqa: E402
+from retrieval import CaseVectorIndex  # noqa: E402
+from storage import KnowledgeStore  # noqa: E402
+from structured import split_structured_diagnosis  # noqa: E402
+
+EQUIPMENT = ["HVAC System", "Electrical Panel", "Mechanical Equipment", "Plumbing System", "Industrial Machine"]
+SYMPTOMS = ["Unusual Noise", "Overheating", "Reduced Performance", "Leaks", "Error Codes", "Smell",
+            "Visual Damage", "Intermittent Operation", "High Error Rate", "Network Issues", "Slow Response",
+            "Complete Failure"]
+ENVIRONMENT = ["High Temperature", "High Humidity", "Dusty Environment", "Vibration", "Corrosive Atmosphere",
+               "Network Storm", "Power Fluctuations", "None"]
+DESCRIPTION = "Supply fan grinds on start-up and the unit trips on high discharge temperature after ~10 minutes."
+
+
+def random_case(rng):
+    return {
+        'equipment_type': rng.choice(EQUIPMENT),
+        'severity': rng.choice(["Low", "Medium", "High", "Critical"]),
+        'urgency': rng.choice(["Routine", "Soon", "Urgent", "Emergency"]),
+        'symptoms': rng.sample(SYMPTOMS, rng.randint(1, 4)),
+        'environment': rng.sample(ENVIRONMENT, rng.randint(0, 2)),
+        'issue_description': DESCRIPTION,
+        'image_paths': [],
+        'images_count': 0,
+    }
+
+
+def bench_app_reruns(args):
+    """Full-script rerun cost of app.py via Streamlit's AppTest"""
+    from streamlit.testing.v1 import AppTest
+
+    with installed(FakeBackend(latency=args.latency, seed=args.seed)):
+        app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+        started = time.perf_counter()
+        app.run()
+        cold = time.perf_counter() - started
+
+        reruns = []
+        rerun_cpu = []
+        for i in range(args.reruns):
+            app.text_area(key="issue_input").input(f"{DESCRIPTION} (edit {i})")
+            started = time.perf_counter()
+            started_cpu = time.process_time()
+            app.run()
+            reruns.append(time.perf_counter() - started)
+            rerun_cpu.append(time.process_time() - started_cpu)
+
+        app.sidebar.text_input[0].input("benchmark-key")
+        app.run()
+        started = time.perf_counter()
+        app.button[0].click().run()
+        diagnosis = time.perf_counter() - started
+        errors = [element.value for element in app.exception]
+
+    reruns.sort()
+    rerun_cpu.sort()
+    return {
+        "cold_run_seconds": cold,
+        "rerun_p50_seconds": percentile(reruns, 0.5),
+        "rerun_p95_seconds": percentile(reruns, 0.95),
+        "rerun_cpu_p50_seconds": percentile(rerun_cpu, 0.5),
+        "diagnosis_click_seconds": diagnosis,
+        "script_exceptions": len(errors),
+    }
+
+
+# Run in a fresh interpreter so nothing is imported yet; prints the timings as JSON
+STARTUP_PROBE = """
+import json, sys, time
+started, started_cpu = time.perf_counter(), time.process_time()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=120)
+app.run()
+print(json.dumps({
+    "streamlit_import": imported - started,
+    "first_run": time.perf_counter() - imported,
+    "total": time.perf_counter() - started,
+    "cpu": time.process_time() - started_cpu,
+    "exceptions": len(app.exception),
+}))
+"""
+
+
+def bench_app_startup(args):
+    """Time to interactive for a fresh server process: imports plus the first full run of app.py"""
+    samples = []
+    for _ in range(args.startup_samples):
+        # Run from the repo root so .streamlit/config.toml applies, as with `streamlit run app.py`
+        output = subprocess.run([sys.executable, "-c", STARTUP_PROBE, os.path.join(ROOT, "app.py")], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    def median(field):
+        return percentile(sorted(sample[field] for sample in samples), 0.5)
+
+    return {
+        "streamlit_import_seconds": median("streamlit_import"),
+        "first_run_seconds": median("first_run"),
+        "time_to_interactive_seconds": median("total"),
+        "startup_cpu_seconds": median("cpu"),
+        "script_exceptions": max(sample["exceptions"] for sample in samples),
+    }
+
+
+def bench_image_preprocessing(args):
+    """Throughput of the decode/downscale/encode stage behind process_uploaded_image"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(args.seed)
+    images = []
+    for _ in range(args.images):
+        image = Image.new("RGB", (4032, 3024), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(4032), rng.randrange(3024)
+            draw.rectangle([x, y, x + 400, y + 300], fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=92)
+        images.append(buffer.getvalue())
+
+    cache = ResultCache(max_entries=len(images))
+    started = time.perf_counter()
+    for image_bytes in images:
+        digest = make_key(image_bytes)
+        cache.set(digest, preprocess_image(image_bytes, digest))
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for image_bytes in images:
+        cache.get(make_key(image_bytes))
+    warm = time.perf_counter() - started
+
+    return {
+        "cold_images_per_second": len(images) / cold,
+        "memoized_images_per_second": len(images) / warm,
+        "source_megapixels": 4032 * 3024 / 1e6,
+    }
+
+
+def bench_pattern_lookup(args):
+    """get_learned_insights latency as the pattern store grows"""
+    rng = random.Random(args.seed)
+    results = {}
+    for size in args.pattern_sizes:
+        store = KnowledgeStore(os.path.join(WORKDIR, f"patterns-{size}.db"), batch_size=5000)
+        knowledge_base = KnowledgeBase(store)
+        started = time.perf_counter()
+        for _ in range(size):
+            case = random_case(rng)
+            knowledge_base.learn_from_case(
+                case['equipment_type'], case['symptoms'], case['environment'],
+                "Cause: worn bearing. Problem: clogged filter.", case['severity']
+            )
+        knowledge_base.flush()
+        learn = time.perf_counter() - started
+
+        queries = [random_case(rng) for _ in range(200)]
+        cold, memoized = [], []
+        for case in queries:
+            knowledge_base.index._memo.clear()
+            started = time.perf_counter()
+            knowledge_base.get_learned_insights(case['equipment_type'], case['symptoms'], case['environment'])
+            cold.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            knowledge_base.get_learned_insights(case['equipment_type'], case['symptoms'], case['environment'])
+            memoized.append(time.perf_counter() - started)
+        cold.sort()
+        memoized.sort()
+        results[f"cases_{size}"] = {
+            "patterns": knowledge_base.pattern_count(),
+            "learn_cases_per_second": size / learn,
+            "lookup_p50_seconds": percentile(cold, 0.5),
+            "lookup_p99_seconds": percentile(cold, 0.99),
+            "memoized_lookup_p50_seconds": percentile(memoized, 0.5),
+        }
+        store.close()
+    return results
+
+
+def random_description(rng):
+    parts = [
+        rng.choice(["Unit", "Compressor", "Pump", "Fan", "Breaker", "Motor", "Controller", "Valve"]),
+        rng.choice(["shows error", "throws code", "trips with", "logs alarm"]),
+        f"{rng.choice('EFPA')}-{rng.randrange(100)}",
+        rng.choice(["after start-up", "under load", "every few minutes", "overnight", "when humid"]),
+        rng.choice(["with grinding noise", "and runs hot", "with low pressure", "and leaks oil", "intermittently"]),
+        rng.choice(["bearing worn", "filter clogged", "capacitor bulging", "belt slipping", "sensor drifting"]),
+    ]
+    return " ".join(parts)
+
+
+def bench_similar_cases(args):
+    """Similar-case retrieval: bulk build rate, peak memory and top-k query latency as history grows"""
+    rng = random.Random(args.seed)
+    results = {}
+    for size in args.retrieval_sizes:
+        index = CaseVectorIndex()
+        tracemalloc.start()
+        started = time.perf_counter()
+        index.add_many(
+            (random_description(rng), {'id': i}, rng.choice(EQUIPMENT)) for i in range(size)
+        )
+        build = time.perf_counter() - started
+        build_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+        queries = [random_description(rng) for _ in range(64)]
+        single = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search([query], k=3, equipment_type=EQUIPMENT[0])
+            single.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        index.search(queries, k=3)
+        batched = (time.perf_counter() - started) / len(queries)
+        single.sort()
+        results[f"cases_{size}"] = {
+            "build_cases_per_second": size / build,
+            "build_peak_mb": build_peak,
+            "query_p50_seconds": percentile(single, 0.5),
+            "query_p95_seconds": percentile(single, 0.95),
+            "batched_query_seconds": batched,
+        }
+    return results
+
+
+def bench_archive(args):
+    """Knowledge base export/import throughput and peak Python memory, JSONL and Parquet"""
+    rng = random.Random(args.seed)
+    diagnosis_text, structured = split_structured_diagnosis(DEFAULT_TEXT)
+    source = KnowledgeBase(KnowledgeStore(os.path.join(WORKDIR, "archive-source.db"), batch_size=5000))
+    for _ in range(args.archive_cases):
+        case = dict(random_case(rng), issue_description=random_description(rng),
+                    timestamp=datetime.now().isoformat(), diagnosis=diagnosis_text, structured=structured)
+        source.record_case(case)
+        source.learn_from_case(case['equipment_type'], case['symptoms'], case['environment'], diagnosis_text,
+                               case['severity'], issue_description=case['issue_description'], case_id=case['id'],
+                               structured=structured)
+    source.flush()
+
+    def peak_mb(func, *func_args):
+        tracemalloc.start()
+        try:
+            func(*func_args)
+            return tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+
+    def fresh_target(name):
+        path = os.path.join(WORKDIR, f"archive-{name}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return KnowledgeBase(KnowledgeStore(path, batch_size=5000))
+
+    results = {}
+    for name, parquet in (("jsonl_gz", False), ("parquet", True)):
+        path = os.path.join(WORKDIR, f"archive.{'parquet' if parquet else 'jsonl.gz'}")
+        started = time.perf_counter()
+        counts = export_archive(source, path, parquet)
+        export_seconds = time.perf_counter() - started
+
+        # Timed as in the app, with the similar-case index built and updated as cases arrive
+        target = fresh_target(name)
+        target.warm_case_vectors(background=False)
+        started = time.perf_counter()
+        import_archive(target, path, parquet)
+        import_seconds = time.perf_counter() - started
+        restored = target.case_count() == source.case_count() and target.pattern_count() == source.pattern_count()
+        target.store.close()
+
+        # Memory is measured in separate passes: tracemalloc slows everything down, and the
+        # similar-case index (a dense matrix sized by case count) is left out of the import peak
+        export_peak = peak_mb(export_archive, source, os.path.join(WORKDIR, "archive-peak"), parquet)
+        target = fresh_target(name)
+        import_peak = peak_mb(import_archive, target, path, parquet)
+        target.store.close()
+
+        records = sum(counts.values())
+        results[name] = {
+            "records": records,
+            "archive_bytes": os.path.getsize(path),
+            "export_records_per_second": records / export_seconds,
+            "import_records_per_second": records / import_seconds,
+            "export_peak_mb": export_peak,
+            "import_peak_mb": import_peak,
+            "restored": restored,
+        }
+    source.store.close()
+    return results
+
+
+def bench_diagnosis_modes(args):
+    """Per-image analysis pipeline (N+1 calls) vs one multimodal diagnosis call, as the app runs them.
+
+    Each case uploads fresh photos, so any analyses the app would start on
+    upload (analyze_on_upload) are made and counted before the diagnosis
+    job runs. end_to_end times include those analyses, which are on the
+    critical path in submit mode or when the technician submits before
+    they finish; after_uploads times start once they have settled.
+    """
+    from PIL import Image
+
+    rng = random.Random(args.seed)
+    knowledge_base = KnowledgeBase(KnowledgeStore(os.path.join(WORKDIR, "modes.db")))
+    results = {}
+    for mode in ("pipeline", "multimodal"):
+        multimodal = mode == "multimodal"
+        backend = FakeBackend(latency=args.latency, image_latency=args.image_latency, seed=args.seed)
+        client = GeminiClient(requests_per_minute=100000, burst=1000, metrics=MetricsRegistry())
+        queue = AnalysisQueue(functools.partial(analyze_image_with_gemini, client=client),
+                              ResultCache(max_entries=256), max_workers=config.ANALYSIS_CONCURRENCY)
+        assembler = PromptAssembler(client.count_tokens, config.PROMPT_TOKEN_BUDGET)
+        latencies = []
+        end_to_end = []
+        upload_calls = 0
+        with installed(backend):
+            for _ in range(args.mode_cases):
+                case = random_case(rng)
+                images = []
+                for _ in range(args.images_per_case):
+                    buffer = BytesIO()
+                    Image.new("RGB", (2048, 1536), tuple(rng.randrange(256) for _ in range(3))).save(
+                        buffer, format="JPEG", quality=90)
+                    images.append(preprocess_image(buffer.getvalue(), make_key(buffer.getvalue())))
+
+                calls_before = backend.calls
+                uploaded = time.perf_counter()
+                if analyze_on_upload(multimodal):
+                    context = f"Equipment: {case['equipment_type']}, Severity: {case['severity']}"
+                    for future in [queue.submit(image_analysis_key(image.digest, case['equipment_type'],
+                                                                   case['severity']),
+                                                image, case['equipment_type'], context)
+                                   for image in images]:
+                        future.result()
+                upload_calls += backend.calls - calls_before
+
+                request = {
+                    'case': dict(case, images_count=len(images)),
+                    'images': images,
+                    'image_analysis_results': None,
+                    'multimodal': multimodal,
+                    'expert_mode': False,
+                    'stream': False,
+                    'bypass_cache': True,
+                }
+                started = time.perf_counter()
+                run_diagnosis_job(request, lambda **_: None, client, knowledge_base, assembler,
+                                  ResultCache(max_entries=1), queue)
+                finished = time.perf_counter()
+                latencies.append(finished - started)
+                end_to_end.append(finished - uploaded)
+        latencies.sort()
+        end_to_end.sort()
+        results[mode] = {
+            "end_to_end_p50_seconds": percentile(end_to_end, 0.5),
+            "after_uploads_p50_seconds": percentile(latencies, 0.5),
+            "model_calls_per_case": backend.calls / args.mode_cases,
+            "upload_analysis_calls_per_case": upload_calls / args.mode_cases,
+            "prompt_tokens_per_case": backend.prompt_tokens / args.mode_cases,
+            "response_tokens_per_case": backend.response_tokens / args.mode_cases,
+        }
+    results["images_per_case"] = args.images_per_case
+    return results
+
+
+FINDINGS = [
+    "- Heavy corrosion on the motor housing around the mounting bolts",
+    "- Oil residue below the shaft seal suggests a slow leak",
+    "- Discoloured insulation on the supply cable near the terminal box",
+    "- Drive belt shows glazing and cracks along its inner face",
+    "- Cooling fins are clogged with dust and debris",
+    "- Missing guard on the coupling is a safety hazard",
+    "- Bearing housing shows signs of overheating discoloration",
+    "- Loose terminal screw visible in the junction box",
+]
+
+
+def bench_prompt_budget(args):
+    """Diagnosis prompt size as photos are added, without and with the token budget"""
+    rng = random.Random(args.seed)
+    client = GeminiClient(requests_per_minute=100000, burst=1000)
+    insights = [{'count': 12, 'common_issues': ["worn bearing", "clogged filter"], 'severity_dist': {'High': 8},
+                 'symptoms': ["Unusual Noise", "Overheating"]}] * 2
+    similar = [{'similarity_score': 0.5 - i / 10, 'severity': "High", 'issue_description': random_description(rng),
+                'key_issues': ["worn bearing"]} for i in range(3)]
+    results = {}
+    with installed(FakeBackend(latency=0.0)):
+        for photos in args.budget_photos:
+            case = dict(random_case(rng), images_count=photos)
+            # Photos of the same fault repeat most of each other's findings
+            analyses = ["Visible damage:\n" + "\n".join(rng.sample(FINDINGS, 5)) + "\nUrgency: High"
+                        for _ in range(photos)]
+            full = build_diagnosis_prompt(case, insights, analyses, expert_mode=True, similar_cases=similar,
+                                          structured_output=True)
+            assembler = PromptAssembler(client.count_tokens, args.prompt_budget)
+            started = time.perf_counter()
+            _prompt, report = assembler.assemble(case, insights, analyses, expert_mode=True,
+                                                 similar_cases=similar, structured_output=True)
+            cold = time.perf_counter() - started
+            started = time.perf_counter()
+            assembler.assemble(case, insights, analyses, expert_mode=True, similar_cases=similar,
+                               structured_output=True)
+            cached = time.perf_counter() - started
+            results[f"photos_{photos}"] = {
+                "unbudgeted_prompt_tokens": client.count_tokens(full),
+                "budgeted_prompt_tokens": report['tokens'],
+                "duplicate_findings": report['duplicate_findings'],
+                "trim_steps": len(report['trimmed']),
+                "assemble_seconds": cold,
+                "cached_assemble_seconds": cached,
+            }
+    results["budget_tokens"] = args.prompt_budget
+    return results
+
+
+def bench_concurrent_technicians(args):
+    """N simulated technicians sharing one GeminiClient and knowledge base"""
+    resilience.backoff_delay = lambda attempt, base=1.0, cap=30.0: 0.01 * (attempt + 1)
+    backend = FakeBackend(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    metrics = MetricsRegistry()
+    knowledge_base = KnowledgeBase(KnowledgeStore(os.path.join(WORKDIR, "technicians.db")))
+    client = GeminiClient(requests_per_minute=100000, burst=1000, metrics=metrics)
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def technician(worker_id):
+        rng = random.Random(args.seed + worker_id)
+        for _ in range(args.cases_per_technician):
+            case = random_case(rng)
+            started = time.perf_counter()
+            try:
+                diagnosis, structured = split_structured_diagnosis(diagnose_case(client, case, knowledge_base))
+                knowledge_base.learn_from_case(
+                    case['equipment_type'], case['symptoms'], case['environment'], diagnosis, case['severity'],
+                    structured=structured
+                )
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                with lock:
+                    failures.append(type(e).__name__)
+
+    with installed(backend):
+        threads = [threading.Thread(target=technician, args=(i,)) for i in range(args.technicians)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    knowledge_base.flush()
+
+    latencies.sort()
+    return {
+        "technicians": args.technicians,
+        "cases_per_minute": len(latencies) / elapsed * 60,
+        "case_p50_seconds": percentile(latencies, 0.5),
+        "case_p95_seconds": percentile(latencies, 0.95),
+        "failed_cases": len(failures),
+        "model_calls": backend.calls,
+        "injected_failures": backend.failures,
+        "retries": sum(metrics.summary()['retries'].values()),
+    }
+
+
+BENCHMARKS = {
+    "app_startup": bench_app_startup,
+    "app_reruns": bench_app_reruns,
+    "image_preprocessing": bench_image_preprocessing,
+    "pattern_lookup": bench_pattern_lookup,
+    "similar_cases": bench_similar_cases,
+    "archive": bench_archive,
+    "diagnosis_modes": bench_diagnosis_modes,
+    "prompt_budget": bench_prompt_budget,
+    "concurrent_technicians": bench_concurrent_technicians,
+}
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and value is not None:
+            yield name, value
+
+
+def compare(current, baseline, tolerance):
+    """Return a list of human-readable regressions"""
+    previous = dict(_flatten(baseline.get("results", {})))
+    regressions = []
+    for name, value in _flatten(current["results"]):
+        before = previous.get(name)
+        if not before:
+            continue
+        if name.endswith("_seconds") and value > before * (1 + tolerance):
+            regressions.append(f"{name}: {before:.6g} -> {value:.6g} (slower)")
+        elif name.endswith(("_per_second", "_per_minute")) and value < before * (1 - tolerance):
+            regressions.append(f"{name}: {before:.6g} -> {value:.6g} (lower throughput)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run InsightFlow's offline benchmarks")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run a subset of benchmarks")
+    parser.add_argument("-o", "--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency per call (s)")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="fraction of fake calls that fail with 429/503")
+    parser.add_argument("--startup-samples", type=int, default=3)
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--images", type=int, default=6)
+    parser.add_argument("--pattern-sizes", type=int, nargs="+", default=[1000, 10000, 30000])
+    parser.add_argument("--retrieval-sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--archive-cases", type=int, default=20000)
+    parser.add_argument("--images-per-case", type=int, default=3)
+    parser.add_argument("--image-latency", type=float, default=0.02, help="extra fake latency per inline image (s)")
+    parser.add_argument("--mode-cases", type=int, default=5)
+    parser.add_argument("--budget-photos", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--prompt-budget", type=int, default=config.PROMPT_TOKEN_BUDGET)
+    parser.add_argument("--technicians", type=int, default=8)
+    parser.add_argument("--cases-per-technician", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"running {name}...", file=sys.stderr)
+        started = time.perf_counter()
+        results[name] = BENCHMARKS[name](args)
+        print(f"  done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_latency_seconds": args.latency,
+            "fake_error_rate": args.error_rate,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+    print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            regressions = compare(report, json.load(fh), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
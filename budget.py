@@ -0,0 +1,166 @@
+"""Token-budgeted assembly of the diagnosis prompt"""
+import re
+
+from cache import ResultCache, make_key
+from prompts import diagnosis_prompt_sections
+from retrieval import STOP_WORDS
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+# Lines with fewer content words (headings, "Urgency: High") are never treated as duplicates
+MIN_FINDING_WORDS = 4
+# Jaccard overlap of content words above which two findings count as the same
+DUPLICATE_OVERLAP = 0.8
+# Tokens per character assumed until count_tokens has measured a prompt
+DEFAULT_TOKENS_PER_CHAR = 0.25
+# Lines of findings kept per image at each successive trimming step
+FINDING_LIMITS = (8, 4, 2)
+
+
+def _finding_words(line):
+    return frozenset(word for word in WORD_RE.findall(line.lower()) if word not in STOP_WORDS)
+
+
+def dedupe_findings(analyses):
+    """Drop lines repeating a finding already reported for this or an earlier image.
+
+    Returns (analyses, number of lines dropped).
+    """
+    seen = []
+    dropped = 0
+    result = []
+    for analysis in analyses:
+        kept = []
+        for line in analysis.splitlines():
+            words = _finding_words(line)
+            if len(words) >= MIN_FINDING_WORDS:
+                if any(len(words & other) >= DUPLICATE_OVERLAP * len(words | other) for other in seen):
+                    dropped += 1
+                    continue
+                seen.append(words)
+            kept.append(line)
+        result.append("\n".join(kept).strip())
+    return result, dropped
+
+
+def shorten_findings(analysis, max_lines):
+    """The first max_lines non-blank lines of an image analysis"""
+    return "\n".join([line.strip() for line in analysis.splitlines() if line.strip()][:max_lines])
+
+
+class PromptAssembler:
+    """Builds diagnosis prompts that fit a token budget.
+
+    Image findings repeated across photos are always dropped. When the
+    prompt is over budget, inputs are trimmed lowest value first: similar
+    past cases (least similar first), learned patterns after the best
+    one, the long expert template, image findings per photo, and finally
+    the last pattern. The case itself, the attached-image notes and the
+    output format are never trimmed, so a prompt can stay over budget.
+
+    Only the final prompt is measured with count_tokens; the trimming
+    steps in between are planned with the tokens-per-character ratio of
+    the last measurement, so a prompt within budget costs one count call
+    and a trimmed one usually two. Counts and deduplicated findings are
+    cached by content hash.
+    """
+
+    def __init__(self, count_tokens, budget, cache=None):
+        self._count_tokens = count_tokens
+        self.budget = budget
+        self.cache = cache if cache is not None else ResultCache(max_entries=512)
+        self._tokens_per_char = DEFAULT_TOKENS_PER_CHAR
+
+    def count(self, text):
+        """Return (tokens, exact); exact is False when count_tokens failed and the size is estimated"""
+        key = make_key("tokens", text)
+        tokens = self.cache.get(key)
+        if tokens is not None:
+            return tokens, True
+        try:
+            tokens = self._count_tokens(text)
+        except Exception:
+            return self._estimate(text), False
+        self.cache.set(key, tokens)
+        if text:
+            self._tokens_per_char = tokens / len(text)
+        return tokens, True
+
+    def _estimate(self, text):
+        return int(len(text) * self._tokens_per_char)
+
+    def _dedupe(self, analyses):
+        key = make_key("findings", *analyses)
+        deduped = self.cache.get(key)
+        if deduped is None:
+            deduped = dedupe_findings(analyses)
+            self.cache.set(key, deduped)
+        return deduped
+
+    @staticmethod
+    def _trim_steps(inputs, expert_mode):
+        """Cut inputs one step at a time, lowest value first, yielding what was cut"""
+        while inputs['similar_cases']:
+            inputs['similar_cases'].pop()
+            yield "similar case"
+        while len(inputs['insights']) > 1:
+            inputs['insights'].pop()
+            yield "learned pattern"
+        if expert_mode:
+            inputs['compact_instructions'] = True
+            yield "expert template"
+        analyses = inputs['image_analysis_results']
+        for limit in FINDING_LIMITS:
+            if any(len(analysis.splitlines()) > limit for analysis in analyses):
+                inputs['image_analysis_results'] = [shorten_findings(analysis, limit) for analysis in analyses]
+                yield "image findings"
+        if inputs['insights']:
+            inputs['insights'].pop()
+            yield "learned pattern"
+
+    def assemble(self, case, insights, image_analysis_results=(), expert_mode=False, attached_images=0,
+                 similar_cases=None, structured_output=False):
+        """Return (prompt, report) for the same arguments as prompts.build_diagnosis_prompt.
+
+        report holds the prompt's 'tokens' (and whether the count is
+        'exact'), the 'budget', whether it is still 'over_budget', the
+        number of 'duplicate_findings' dropped and the 'trimmed' steps.
+        """
+        analyses, duplicates = self._dedupe(list(image_analysis_results))
+        inputs = {
+            'insights': list(insights or ()),
+            'similar_cases': sorted(similar_cases or (), key=lambda similar: -similar['similarity_score']),
+            'image_analysis_results': analyses,
+            'compact_instructions': False,
+        }
+
+        def build():
+            sections = diagnosis_prompt_sections(
+                case, inputs['insights'], inputs['image_analysis_results'], expert_mode, attached_images,
+                inputs['similar_cases'], structured_output, inputs['compact_instructions']
+            )
+            return "".join(text for _name, text in sections)
+
+        prompt = build()
+        tokens, exact = self.count(prompt)
+        steps = self._trim_steps(inputs, expert_mode)
+        trimmed = []
+        while self.budget and tokens > self.budget:
+            exhausted = True
+            for step in steps:
+                trimmed.append(step)
+                prompt = build()
+                if self._estimate(prompt) <= self.budget:
+                    exhausted = False
+                    break
+            tokens, exact = self.count(prompt)
+            if exhausted:
+                break
+
+        return prompt, {
+            'tokens': tokens,
+            'exact': exact,
+            'budget': self.budget,
+            'over_budget': bool(self.budget) and tokens > self.budget,
+            'duplicate_findings': duplicates,
+            'trimmed': trimmed,
+        }
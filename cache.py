@@ -0,0 +1,136 @@
+"""Content-addressed result cache shared across Streamlit sessions"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(*parts):
+    """Build a stable SHA-256 cache key from bytes/str parts"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU cache with TTL expiry and an optional on-disk tier.
+
+    Values stored in the disk tier must be JSON-serializable.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_entries=256, ttl_seconds=24 * 60 * 60, disk_dir=None):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _expired(self, created):
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as fh:
+                record = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if self._expired(record.get("created", 0)):
+            self._remove_disk(key)
+            return None
+        return record
+
+    def _write_disk(self, key, created, value):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump({"created": created, "value": value}, fh)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def _remove_disk(self, key):
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _prune_disk(self):
+        """Drop expired entries from the disk tier"""
+        if self.ttl_seconds <= 0:
+            return
+        for root, _dirs, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".json") and self._read_disk(name[:-5]) is None:
+                    self._remove_disk(name[:-5])
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        record = self._read_disk(key) if self.disk_dir else None
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, record["created"], record["value"])
+            return record["value"]
+
+    def _store(self, key, created, value):
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        """Store value under key in memory and, if enabled, on disk"""
+        created = time.time()
+        with self._lock:
+            self._store(key, created, value)
+            self._writes += 1
+            prune = self.disk_dir and self._writes % self.PRUNE_EVERY == 0
+        if self.disk_dir:
+            self._write_disk(key, created, value)
+            if prune:
+                self._prune_disk()
+
+    def stats(self):
+        """Return hit/miss counters for display"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "entries": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
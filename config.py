@@ -0,0 +1,89 @@
+"""Runtime configuration for InsightFlow, read from environment variables"""
+import os
+
+
+def _int_env(name, default):
+    """Read an integer setting from the environment, falling back to default"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Gemini model used for every call
+MODEL_NAME = os.environ.get("INSIGHTFLOW_MODEL", "gemini-1.5-pro-latest")
+
+# Per-image analysis cache (in-memory LRU with optional on-disk tier)
+ANALYSIS_CACHE_SIZE = _int_env("INSIGHTFLOW_ANALYSIS_CACHE_SIZE", 256)
+ANALYSIS_CACHE_TTL = _int_env("INSIGHTFLOW_ANALYSIS_CACHE_TTL", 24 * 60 * 60)
+ANALYSIS_CACHE_DIR = os.environ.get("INSIGHTFLOW_ANALYSIS_CACHE_DIR", "")
+
+# Maximum number of image analyses in flight at once across the process
+ANALYSIS_CONCURRENCY = _int_env("INSIGHTFLOW_ANALYSIS_CONCURRENCY", 4)
+
+# When uploads are analyzed: "background" (queued on upload, picked up on later
+# reruns), "submit" (only when a diagnosis is requested) or "inline" (block the form)
+IMAGE_ANALYSIS_MODE = os.environ.get("INSIGHTFLOW_IMAGE_ANALYSIS_MODE", "background")
+
+# Shared SQLite knowledge base (diagnosis history, learned patterns, equipment insights)
+KNOWLEDGE_DB_PATH = os.environ.get(
+    "INSIGHTFLOW_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "insightflow.db")
+)
+KNOWLEDGE_WRITE_BATCH = _int_env("INSIGHTFLOW_DB_WRITE_BATCH", 50)
+KNOWLEDGE_FLUSH_INTERVAL = _int_env("INSIGHTFLOW_DB_FLUSH_INTERVAL", 2)
+
+# Knowledge base export/import (archive.py): records per compressed chunk or Parquet row group
+ARCHIVE_CHUNK_RECORDS = _int_env("INSIGHTFLOW_ARCHIVE_CHUNK_RECORDS", 1000)
+
+# How images reach the diagnosis: "pipeline" (one analysis call per image, then a
+# text-only diagnosis) or "multimodal" (images sent inline with the diagnosis call)
+DIAGNOSIS_MODE = os.environ.get("INSIGHTFLOW_DIAGNOSIS_MODE", "pipeline")
+
+# Diagnosis job pool shared by every session; finished jobs are kept in the knowledge base for JOB_RETENTION seconds
+DIAGNOSIS_WORKERS = _int_env("INSIGHTFLOW_DIAGNOSIS_WORKERS", 8)
+JOB_RETENTION = _int_env("INSIGHTFLOW_JOB_RETENTION", 7 * 24 * 60 * 60)
+JOB_POLL_INTERVAL_MS = _int_env("INSIGHTFLOW_JOB_POLL_INTERVAL_MS", 500)
+
+# Ask for a JSON block of root causes, urgency, parts, steps and safety items after the report (0 disables)
+STRUCTURED_DIAGNOSIS = _int_env("INSIGHTFLOW_STRUCTURED_DIAGNOSIS", 1)
+
+# Text prompt budget in tokens (count_tokens); lowest-value sections are trimmed past it (0 disables trimming)
+PROMPT_TOKEN_BUDGET = _int_env("INSIGHTFLOW_PROMPT_TOKEN_BUDGET", 2500)
+PROMPT_FRAGMENT_CACHE_SIZE = _int_env("INSIGHTFLOW_PROMPT_FRAGMENT_CACHE_SIZE", 512)
+
+# Similar-case retrieval: hashed TF-IDF vector width and neighbours added to the prompt
+RETRIEVAL_DIMENSIONS = _int_env("INSIGHTFLOW_RETRIEVAL_DIMENSIONS", 1024)
+RETRIEVAL_TOP_K = _int_env("INSIGHTFLOW_RETRIEVAL_TOP_K", 3)
+
+# Full diagnosis cache keyed by the normalized prompt, persisted across restarts
+DIAGNOSIS_CACHE_SIZE = _int_env("INSIGHTFLOW_DIAGNOSIS_CACHE_SIZE", 128)
+DIAGNOSIS_CACHE_TTL = _int_env("INSIGHTFLOW_DIAGNOSIS_CACHE_TTL", 7 * 24 * 60 * 60)
+DIAGNOSIS_CACHE_DIR = os.environ.get(
+    "INSIGHTFLOW_DIAGNOSIS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".insightflow_cache", "diagnoses")
+)
+
+# Image preprocessing: model payload size/format/quality and display preview size
+IMAGE_MAX_SIZE = _int_env("INSIGHTFLOW_IMAGE_MAX_SIZE", 1024)
+IMAGE_PREVIEW_SIZE = _int_env("INSIGHTFLOW_IMAGE_PREVIEW_SIZE", 512)
+IMAGE_FORMAT = os.environ.get("INSIGHTFLOW_IMAGE_FORMAT", "JPEG")
+IMAGE_QUALITY = _int_env("INSIGHTFLOW_IMAGE_QUALITY", 85)
+IMAGE_CACHE_SIZE = _int_env("INSIGHTFLOW_IMAGE_CACHE_SIZE", 64)
+IMAGE_CACHE_TTL = _int_env("INSIGHTFLOW_IMAGE_CACHE_TTL", 60 * 60)
+
+# Batch mode (batch.py) defaults
+BATCH_CONCURRENCY = _int_env("INSIGHTFLOW_BATCH_CONCURRENCY", 4)
+BATCH_REQUESTS_PER_MINUTE = _int_env("INSIGHTFLOW_BATCH_RPM", 60)
+
+# Shared Gemini client: process-wide quota, retries and circuit breaker
+GEMINI_REQUESTS_PER_MINUTE = _int_env("INSIGHTFLOW_GEMINI_RPM", 60)
+GEMINI_BURST = _int_env("INSIGHTFLOW_GEMINI_BURST", 5)
+GEMINI_MAX_ATTEMPTS = _int_env("INSIGHTFLOW_GEMINI_MAX_ATTEMPTS", 5)
+GEMINI_QUEUE_TIMEOUT = _int_env("INSIGHTFLOW_GEMINI_QUEUE_TIMEOUT", 120)
+GEMINI_BREAKER_THRESHOLD = _int_env("INSIGHTFLOW_GEMINI_BREAKER_THRESHOLD", 5)
+GEMINI_BREAKER_RESET = _int_env("INSIGHTFLOW_GEMINI_BREAKER_RESET", 30)
+
+# Model-call metrics: percentile window and optional JSONL sink for every call
+METRICS_WINDOW = _int_env("INSIGHTFLOW_METRICS_WINDOW", 2048)
+METRICS_JSONL_PATH = os.environ.get("INSIGHTFLOW_METRICS_JSONL", "")
@@ -0,0 +1 @@
+"""Pytest configuration: being at the repository root, this file puts the root on sys.path so tests import the app modules directly"""
@@ -0,0 +1,138 @@
+"""Shared Gemini client: reused model handles, process-wide rate limiting, retries and a circuit breaker"""
+import json
+import threading
+import time
+
+import config
+from metrics import payload_bytes, prompt_chars, usage_tokens
+from resilience import CircuitBreaker, TokenBucket, call_with_retry
+
+
+def _genai():
+    """The Gemini SDK, imported on first use rather than at start-up"""
+    # The import costs nearly as much as Streamlit's own, and the page can render before a key is entered
+    import google.generativeai as genai
+    return genai
+
+
+class GeminiClient:
+    """One instance per process; every Gemini call in the app goes through it"""
+
+    def __init__(self, requests_per_minute=config.GEMINI_REQUESTS_PER_MINUTE, burst=config.GEMINI_BURST,
+                 max_attempts=config.GEMINI_MAX_ATTEMPTS, queue_timeout=config.GEMINI_QUEUE_TIMEOUT,
+                 failure_threshold=config.GEMINI_BREAKER_THRESHOLD, reset_timeout=config.GEMINI_BREAKER_RESET,
+                 metrics=None):
+        self.limiter = TokenBucket.per_minute(requests_per_minute, burst=burst)
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        self.max_attempts = max_attempts
+        self.queue_timeout = queue_timeout
+        self.metrics = metrics
+        self._models = {}
+        self._api_key = None
+        self._lock = threading.Lock()
+
+    def configure(self, api_key):
+        """Configure the SDK once per distinct key; handles bound to an old key are dropped"""
+        genai = _genai()
+        with self._lock:
+            if api_key != self._api_key:
+                genai.configure(api_key=api_key)
+                self._api_key = api_key
+                self._models.clear()
+
+    def model(self, model_name=None, generation_config=None):
+        """Return a cached GenerativeModel handle"""
+        model_name = model_name or config.MODEL_NAME
+        key = (model_name, json.dumps(generation_config or {}, sort_keys=True, default=str))
+        with self._lock:
+            handle = self._models.get(key)
+            if handle is None:
+                handle = self._models[key] = _genai().GenerativeModel(model_name, generation_config=generation_config)
+            return handle
+
+    def generate(self, contents, stream=False, model_name=None, generation_config=None, kind="generate",
+                 prompt_tokens=None):
+        """generate_content with rate limiting, jittered backoff on 429/5xx and the circuit breaker.
+
+        Wall time (including queueing and retries), time to first chunk,
+        token usage, image payload size and error class are recorded
+        under `kind` when a metrics registry is attached. The pinned SDK
+        reports no usage, so callers that already counted the prompt with
+        count_tokens pass that as prompt_tokens; other counts stay unknown.
+        """
+        started = time.perf_counter()
+        image_bytes = payload_bytes(contents)
+        text_chars = prompt_chars(contents)
+        on_retry = None
+        if self.metrics is not None:
+            on_retry = lambda exc: self.metrics.record_retry(kind, exc)
+        try:
+            response = call_with_retry(
+                self.model(model_name, generation_config).generate_content,
+                contents,
+                stream=stream,
+                max_attempts=self.max_attempts,
+                limiter=self.limiter,
+                limiter_timeout=self.queue_timeout,
+                breaker=self.breaker,
+                on_retry=on_retry
+            )
+        except Exception as e:
+            self._record(kind, started, payload=image_bytes, chars=text_chars, prompt_tokens=prompt_tokens,
+                         error=type(e).__name__)
+            raise
+        if stream:
+            return self._timed_stream(response, kind, started, image_bytes, text_chars, prompt_tokens)
+        self._record(kind, started, response=response, payload=image_bytes, chars=text_chars,
+                     prompt_tokens=prompt_tokens)
+        return response
+
+    def count_tokens(self, contents, model_name=None):
+        """Prompt size in tokens as measured by the SDK's count_tokens.
+
+        Counting has its own quota, so it skips the generate rate limiter
+        and circuit breaker (a throttled count must not block generation)
+        and is not retried; callers fall back to an estimate on failure.
+        """
+        started = time.perf_counter()
+        try:
+            response = call_with_retry(self.model(model_name).count_tokens, contents, max_attempts=1)
+        except Exception as e:
+            self._record("count_tokens", started, chars=prompt_chars(contents), error=type(e).__name__)
+            raise
+        self._record("count_tokens", started, chars=prompt_chars(contents))
+        return response.total_tokens
+
+    def _timed_stream(self, response, kind, started, image_bytes, text_chars, prompt_tokens=None):
+        ttft = None
+        last_chunk = None
+        error = None
+        try:
+            for chunk in response:
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                last_chunk = chunk
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._record(kind, started, response=last_chunk, payload=image_bytes, chars=text_chars, ttft=ttft,
+                         prompt_tokens=prompt_tokens, error=error)
+
+    def _record(self, kind, started, response=None, payload=0, chars=0, ttft=None, prompt_tokens=None, error=None):
+        if self.metrics is None:
+            return
+        reported_prompt_tokens, response_tokens = usage_tokens(response)
+        if reported_prompt_tokens is not None:
+            prompt_tokens = reported_prompt_tokens
+        self.metrics.record_call(
+            kind,
+            time.perf_counter() - started,
+            ttft_seconds=ttft,
+            prompt_tokens=prompt_tokens,
+            response_tokens=response_tokens,
+            payload_bytes=payload,
+            prompt_chars=chars,
+            error=error
+        )
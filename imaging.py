@@ -0,0 +1,63 @@
+"""Image preprocessing: decode once, emit a display preview and a compact model payload"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+class ProcessedImage:
+    """Encoded preview and model payload for one uploaded image"""
+
+    __slots__ = ("digest", "payload", "mime_type", "preview")
+
+    def __init__(self, digest, payload, mime_type, preview):
+        self.digest = digest
+        self.payload = payload
+        self.mime_type = mime_type
+        self.preview = preview
+
+    def as_part(self):
+        """Inline blob accepted by generate_content alongside text parts"""
+        return {"mime_type": self.mime_type, "data": self.payload}
+
+
+def _encode(image, fmt, quality):
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, quality=quality, optimize=fmt == "JPEG")
+    return buffer.getvalue()
+
+
+def preprocess_image(image_bytes, digest, max_size=1024, preview_size=512, fmt="JPEG", quality=85):
+    """Decode image_bytes once and return a ProcessedImage.
+
+    JPEGs are decoded in draft mode, letting libjpeg scale by 1/2..1/8
+    during decoding so large camera images never materialize at full
+    resolution.
+    """
+    fmt = fmt.upper()
+    if fmt not in MIME_TYPES:
+        fmt = "JPEG"
+
+    image = Image.open(BytesIO(image_bytes))
+    if image.format == "JPEG":
+        image.draft("RGB", (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+
+    # Convert to RGB for JPEG/WebP output
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    payload = _encode(image, fmt, quality)
+
+    preview_image = image.copy()
+    preview_image.thumbnail((preview_size, preview_size), Image.Resampling.BILINEAR)
+    preview = _encode(preview_image, "JPEG", 80)
+
+    return ProcessedImage(
+        digest=digest,
+        payload=payload,
+        mime_type=MIME_TYPES[fmt],
+        preview=preview
+    )
@@ -0,0 +1,96 @@
+"""Diagnosis jobs shared by every session, surviving reruns and disconnects"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+
+def _stored(job):
+    """The job as written to the store: everything but the in-progress report"""
+    return {key: value for key, value in job.items() if key != 'partial'}
+
+
+class DiagnosisJobs:
+    """Runs diagnoses on a process-wide worker pool.
+
+    submit() returns a job ID immediately and the script polls status()
+    on each run, so a widget change, a rerun or a dropped connection no
+    longer throws away a diagnosis in flight. run(payload, progress) does
+    the work; it reports its current stage and the report streamed so
+    far through progress(stage=..., partial=...), and returns a
+    JSON-serializable result. Every job is recorded in `store`, so a
+    finished job can be fetched by ID from any session, and jobs cut
+    off by a restart show as failed rather than pending forever.
+    """
+
+    def __init__(self, run, store, max_workers=8, retention=7 * 24 * 60 * 60):
+        self._run = run
+        self._store = store
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="diagnosis")
+        # Only unfinished jobs live in memory; finished ones are read back from the store
+        self._jobs = {}
+        self._lock = threading.Lock()
+        store.fail_unfinished_jobs("The server restarted before this diagnosis finished")
+        store.prune_jobs(time.time() - retention)
+
+    def submit(self, payload):
+        """Queue run(payload, progress) and return the new job's ID"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': QUEUED,
+            'stage': "Waiting for a free worker",
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+            'error_type': None,
+        }
+        self._store.save_job(job)
+        with self._lock:
+            self._jobs[job['id']] = dict(job, partial="")
+        self._executor.submit(self._work, job['id'], payload)
+        return job['id']
+
+    def status(self, job_id):
+        """A snapshot of the job (with 'partial' text while it runs), or None for an unknown ID"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._store.load_job(job_id)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _work(self, job_id, payload):
+        self._update(job_id, status=RUNNING, stage="Starting", started_at=time.time())
+        self._store.save_job(_stored(self.status(job_id)))
+
+        def progress(stage=None, partial=None):
+            fields = {}
+            if stage is not None:
+                fields['stage'] = stage
+            if partial is not None:
+                fields['partial'] = partial
+            self._update(job_id, **fields)
+
+        try:
+            fields = {'status': DONE, 'result': self._run(payload, progress)}
+        except Exception as e:
+            fields = {'status': FAILED, 'error': str(e), 'error_type': type(e).__name__}
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields, finished_at=time.time(), stage=None)
+            finished = _stored(job)
+        # Stored before it leaves memory, so status() never misses it
+        self._store.save_job(finished)
+        with self._lock:
+            del self._jobs[job_id]
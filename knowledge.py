@@ -0,0 +1,327 @@
+"""Shared knowledge base: pattern learning on top of the SQLite store"""
+import re
+import sys
+import threading
+
+from aggregates import EquipmentStats, PatternStats
+from patterns import PatternIndex
+from retrieval import CaseVectorIndex
+
+
+ISSUE_PATTERNS = [re.compile(pattern) for pattern in (
+    r'[Cc]ause[s]?[:\s]+([^\.]+)',
+    r'[Pp]roblem[s]?[:\s]+([^\.]+)',
+    r'[Ii]ssue[s]?[:\s]+([^\.]+)',
+    r'[Ff]ault[s]?[:\s]+([^\.]+)'
+)]
+
+
+def extract_key_issues(diagnosis_text):
+    """Extract key issues from free-text diagnosis for learning.
+
+    Only used for diagnoses without structured fields: older stored
+    cases and answers whose JSON block was missing or invalid.
+    """
+    issues = []
+    for pattern in ISSUE_PATTERNS:
+        issues.extend(pattern.findall(diagnosis_text))
+    return issues[:3]
+
+
+def key_issues_for(diagnosis_text, structured=None):
+    """The case's top root causes, from the structured fields when present"""
+    if structured:
+        return structured['root_causes'][:3]
+    return extract_key_issues(diagnosis_text or "")
+
+
+def pattern_keys(equipment_type, symptoms, environment):
+    """Return (pattern_key, symptom_key, env_key) for a case"""
+    symptom_key = "_".join(sorted(symptoms)) if symptoms else "no_symptoms"
+    env_key = "_".join(sorted(environment)) if environment else "normal_env"
+    return sys.intern(f"{equipment_type}|{symptom_key}|{env_key}"), sys.intern(symptom_key), sys.intern(env_key)
+
+
+def case_text(issue_description, key_issues):
+    """Text indexed for similarity search: the description plus the issues found in its diagnosis"""
+    return " ".join([issue_description or ""] + list(key_issues))
+
+
+def case_summary(case_id, equipment_type, severity, issue_description, key_issues):
+    """Compact record kept per indexed case and shown in the prompt's similar-case section"""
+    return {
+        'id': case_id,
+        'equipment_type': equipment_type,
+        'severity': severity,
+        'issue_description': (issue_description or "")[:200],
+        'key_issues': list(key_issues)
+    }
+
+
+def stored_case_entry(case):
+    """(text, summary, equipment_type) similar-case index entry for a stored case"""
+    key_issues = key_issues_for(case.get('diagnosis'), case.get('structured'))
+    return (
+        case_text(case.get('issue_description'), key_issues),
+        case_summary(case.get('id'), case['equipment_type'], case.get('severity'),
+                     case.get('issue_description'), key_issues),
+        case['equipment_type']
+    )
+
+
+class KnowledgeBase:
+    """Learned patterns, equipment insights and case history shared by every session.
+
+    Patterns are pulled from the store one equipment type at a time, the
+    first time that type is queried or learned from. The similar-case
+    vector index is built from every stored case on its first search, or
+    in the background after warm_case_vectors().
+    """
+
+    def __init__(self, store, retrieval_dimensions=1024):
+        self.store = store
+        self.index = PatternIndex()
+        self.retrieval_dimensions = retrieval_dimensions
+        self._case_vectors = None
+        # Cases learned while the vector index is being built, added once it is ready
+        self._vectors_pending = None
+        self._vectors_last_id = None
+        self._vectors_ready = threading.Event()
+        self._lock = threading.RLock()
+        self._loaded_equipment = set()
+        self._equipment_insights = None
+        self._case_count = store.case_count()
+        self._pattern_count = store.pattern_count()
+
+    def _ensure_loaded(self, equipment_type):
+        if equipment_type not in self._loaded_equipment:
+            for pattern_key, data in self.store.load_patterns(equipment_type).items():
+                self.index.upsert(sys.intern(pattern_key), PatternStats.from_dict(data))
+            self._loaded_equipment.add(equipment_type)
+
+    def warm_case_vectors(self, background=True):
+        """Start building the similar-case index from stored cases (no-op if built or building)"""
+        with self._lock:
+            if self._case_vectors is not None or self._vectors_pending is not None:
+                return
+            self._vectors_pending = []
+            self._vectors_last_id = self.store.max_case_id()
+        if background:
+            threading.Thread(target=self._build_case_vectors, name="case-vectors", daemon=True).start()
+        else:
+            self._build_case_vectors()
+
+    def _stored_case_entries(self):
+        for case in self.store.iter_cases():
+            # Newer cases reach the index through learn_from_case
+            if case.get('id') is not None and case['id'] > self._vectors_last_id:
+                continue
+            yield stored_case_entry(case)
+
+    def _build_case_vectors(self):
+        vectors = CaseVectorIndex(dimensions=self.retrieval_dimensions)
+        try:
+            vectors.add_many(self._stored_case_entries())
+            with self._lock:
+                vectors.add_many(self._vectors_pending)
+                self._case_vectors = vectors
+        finally:
+            with self._lock:
+                self._vectors_pending = None
+            self._vectors_ready.set()
+
+    @property
+    def equipment_insights(self):
+        with self._lock:
+            if self._equipment_insights is None:
+                self._equipment_insights = {
+                    sys.intern(equipment_type): EquipmentStats.from_dict(data)
+                    for equipment_type, data in self.store.load_equipment_insights().items()
+                }
+            return self._equipment_insights
+
+    def case_count(self):
+        return self._case_count
+
+    def pattern_count(self):
+        return self._pattern_count
+
+    def record_case(self, case_data):
+        """Store the case; its 'id' is set to the ID the store assigned"""
+        return self.record_cases([case_data])[0]
+
+    def record_cases(self, cases):
+        """Store several cases in one write, setting each one's 'id'"""
+        case_ids = self.store.insert_cases(cases)
+        with self._lock:
+            self._case_count += len(cases)
+        return case_ids
+
+    def learn_from_case(self, equipment_type, symptoms, environment, diagnosis_text, severity, has_images=False,
+                        issue_description=None, case_id=None, structured=None):
+        """Learn from each case and update patterns.
+
+        structured is the validated output of split_structured_diagnosis();
+        its root causes and parts are recorded as-is, and diagnosis_text
+        is only scanned when it is missing. When issue_description is
+        given the case is also added to the similar-case index (if it has
+        been built; otherwise it is picked up from the store when it is).
+        Only this case's observations are queued for storage, so other
+        processes learning into the same store are not overwritten.
+        """
+        pattern_key, symptom_key, env_key = pattern_keys(equipment_type, symptoms, environment)
+        key_issues = key_issues_for(diagnosis_text, structured)
+        parts = structured['parts'] if structured else ()
+
+        with self._lock:
+            self._ensure_loaded(equipment_type)
+            pattern = self.index.get(pattern_key)
+            if pattern is None:
+                pattern = PatternStats(equipment_type, symptoms, environment)
+                self._pattern_count += 1
+            pattern.record(key_issues, severity, has_images, parts)
+            self.index.upsert(pattern_key, pattern)
+            pattern_delta = PatternStats(equipment_type, symptoms, environment)
+            pattern_delta.record(key_issues, severity, has_images, parts)
+            self.store.queue_pattern(pattern_key, symptom_key, env_key, pattern_delta)
+
+            insights = self.equipment_insights
+            insight = insights.get(equipment_type)
+            if insight is None:
+                insight = insights[sys.intern(equipment_type)] = EquipmentStats()
+            insight.record(symptoms, has_images)
+            insight_delta = EquipmentStats()
+            insight_delta.record(symptoms, has_images)
+            self.store.queue_equipment_insight(equipment_type, insight_delta)
+
+            if issue_description:
+                entry = (case_text(issue_description, key_issues),
+                         case_summary(case_id, equipment_type, severity, issue_description, key_issues),
+                         equipment_type)
+                if self._case_vectors is not None:
+                    self._case_vectors.add(*entry[:2], equipment_type=equipment_type)
+                elif self._vectors_pending is not None and (case_id is None or case_id > self._vectors_last_id):
+                    self._vectors_pending.append(entry)
+
+    def get_learned_insights(self, equipment_type, symptoms, environment, k=2):
+        """Get relevant insights from learned patterns"""
+        with self._lock:
+            self._ensure_loaded(equipment_type)
+            return self.index.query(equipment_type, symptoms, environment, k=k)
+
+    def equipment_summaries(self, top_symptoms=5):
+        """{equipment_type: totals and most common symptoms} for the learning tab"""
+        with self._lock:
+            return {
+                equipment_type: insight.summary(top_symptoms)
+                for equipment_type, insight in self.equipment_insights.items()
+            }
+
+    def top_patterns(self, equipment_type, k=5):
+        """The k most frequently seen symptom/environment patterns for an equipment type"""
+        with self._lock:
+            self._ensure_loaded(equipment_type)
+            return self.index.most_frequent(equipment_type, k)
+
+    def similar_cases(self, issue_description, equipment_type=None, k=3, min_score=0.15, wait=True):
+        """Past cases whose description and diagnosis best match issue_description.
+
+        Returns copies of the case summaries with a 'similarity_score'
+        field. With wait=False an index that is still being built yields
+        no matches instead of blocking.
+        """
+        if not issue_description or not issue_description.strip():
+            return []
+        if self._case_vectors is None:
+            self.warm_case_vectors(background=not wait)
+            if wait:
+                self._vectors_ready.wait()
+            if self._case_vectors is None:
+                return []
+        matches = self._case_vectors.search(
+            [issue_description], k=k, equipment_type=equipment_type, min_score=min_score
+        )[0]
+        return [dict(record, similarity_score=round(score, 3)) for score, record in matches]
+
+    def export_records(self):
+        """Yield the whole knowledge base as archive records, reading the store a page at a time.
+
+        Each record is {'kind', 'key', 'data'}: every equipment insight,
+        then every pattern, then every case oldest first, so nothing is
+        held in memory beyond the current page.
+        """
+        for equipment_type, data in self.store.load_equipment_insights().items():
+            yield {'kind': 'equipment_insight', 'key': equipment_type, 'data': data}
+        for pattern_key, data in self.store.iter_patterns():
+            yield {'kind': 'pattern', 'key': pattern_key, 'data': data}
+        for case in self.store.iter_cases(oldest_first=True):
+            yield {'kind': 'case', 'key': str(case.get('id')), 'data': case}
+
+    def import_records(self, records, chunk_size=500):
+        """Merge archive records from export_records() into this knowledge base.
+
+        Patterns and equipment insights already present are merged with
+        the imported ones; cases are appended with new IDs, without being
+        learned from again. The pattern index is updated record by record
+        and the similar-case index chunk_size cases at a time, and writes
+        go through the store's usual batching. Returns {kind: count}.
+        """
+        counts = {'equipment_insight': 0, 'pattern': 0, 'case': 0}
+        cases = []
+        for record in records:
+            kind = record['kind']
+            if kind == 'case':
+                cases.append(dict(record['data']))
+                if len(cases) >= chunk_size:
+                    self._import_cases(cases)
+                    cases = []
+            elif kind == 'pattern':
+                self._import_pattern(PatternStats.from_dict(record['data']))
+            elif kind == 'equipment_insight':
+                self._import_equipment_insight(record['key'], EquipmentStats.from_dict(record['data']))
+            else:
+                raise ValueError(f"Unknown archive record kind: {kind!r}")
+            counts[kind] += 1
+        self._import_cases(cases)
+        self.flush()
+        return counts
+
+    def _import_pattern(self, imported):
+        pattern_key, symptom_key, env_key = pattern_keys(imported.equipment_type, imported.symptoms,
+                                                         imported.environment)
+        with self._lock:
+            self._ensure_loaded(imported.equipment_type)
+            pattern = self.index.get(pattern_key)
+            if pattern is None:
+                # A copy: the imported aggregate is handed to the store as the delta
+                pattern = PatternStats.from_dict(imported.to_dict())
+                self._pattern_count += 1
+            else:
+                pattern.merge(imported)
+            self.index.upsert(pattern_key, pattern)
+            self.store.queue_pattern(pattern_key, symptom_key, env_key, imported)
+
+    def _import_equipment_insight(self, equipment_type, imported):
+        with self._lock:
+            insights = self.equipment_insights
+            insight = insights.get(equipment_type)
+            if insight is None:
+                insight = insights[sys.intern(equipment_type)] = EquipmentStats.from_dict(imported.to_dict())
+            else:
+                insight.merge(imported)
+            self.store.queue_equipment_insight(equipment_type, imported)
+
+    def _import_cases(self, cases):
+        if not cases:
+            return
+        self.record_cases(cases)
+        entries = [stored_case_entry(case) for case in cases]
+        # An index that hasn't been started picks these cases up from the store when it is built
+        with self._lock:
+            if self._case_vectors is not None:
+                self._case_vectors.add_many(entries)
+            elif self._vectors_pending is not None:
+                self._vectors_pending.extend(entries)
+
+    def flush(self):
+        self.store.flush()
@@ -0,0 +1,240 @@
+"""In-process latency, token and error metrics for model calls"""
+import json
+import math
+import threading
+import time
+from collections import Counter, deque
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def payload_bytes(contents):
+    """Bytes of inline image data in a generate_content request"""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    return sum(len(part.get("data", b"")) for part in contents if isinstance(part, dict))
+
+
+def prompt_chars(contents):
+    """Characters of text in a generate_content request"""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    return sum(len(part) for part in contents if isinstance(part, str))
+
+
+def usage_tokens(response):
+    """(prompt_tokens, response_tokens) from response.usage_metadata, or None for counts the SDK does not report"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None
+    return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+
+
+def add_tokens(total, tokens):
+    """Running token total that stays None until some call reports a count"""
+    if tokens is None:
+        return total
+    return (total or 0) + tokens
+
+
+def format_tokens(tokens):
+    return "n/a" if tokens is None else f"{tokens:,}"
+
+
+class _KindStats:
+    __slots__ = ("count", "errors", "wall_sum", "wall", "ttft", "prompt_tokens", "response_tokens",
+                 "payload_bytes", "prompt_chars")
+
+    def __init__(self, window):
+        self.count = 0
+        self.errors = 0
+        self.wall_sum = 0.0
+        self.wall = deque(maxlen=window)
+        self.ttft = deque(maxlen=window)
+        # None until a call of this kind reports a count
+        self.prompt_tokens = None
+        self.response_tokens = None
+        self.payload_bytes = 0
+        self.prompt_chars = 0
+
+
+class MetricsRegistry:
+    """Thread-safe recorder for model calls, retries and cache hit rates.
+
+    Percentiles are computed over the most recent `window` calls per kind.
+    When jsonl_path is set, every call record is also appended there.
+    Token counts are None (null in JSONL, omitted from the Prometheus
+    export) when nothing reported them, so unknown never reads as zero.
+    """
+
+    def __init__(self, window=2048, jsonl_path=None):
+        self.window = window
+        self.jsonl_path = jsonl_path or None
+        self._kinds = {}
+        self._errors = Counter()
+        self._retries = Counter()
+        self._recent = deque(maxlen=window)
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def register_cache(self, name, cache):
+        """Include cache.stats() in summaries and exports"""
+        with self._lock:
+            self._caches[name] = cache
+
+    def record_retry(self, kind, exc):
+        with self._lock:
+            self._retries[(kind, type(exc).__name__)] += 1
+
+    def record_call(self, kind, wall_seconds, ttft_seconds=None, prompt_tokens=None,
+                    response_tokens=None, payload_bytes=0, prompt_chars=0, error=None):
+        record = {
+            "ts": time.time(),
+            "kind": kind,
+            "wall_seconds": round(wall_seconds, 4),
+            "ttft_seconds": None if ttft_seconds is None else round(ttft_seconds, 4),
+            "prompt_tokens": prompt_tokens,
+            "response_tokens": response_tokens,
+            "payload_bytes": payload_bytes,
+            "prompt_chars": prompt_chars,
+            "error": error,
+        }
+        with self._lock:
+            stats = self._kinds.get(kind)
+            if stats is None:
+                stats = self._kinds[kind] = _KindStats(self.window)
+            stats.count += 1
+            stats.wall_sum += wall_seconds
+            stats.wall.append(wall_seconds)
+            if ttft_seconds is not None:
+                stats.ttft.append(ttft_seconds)
+            stats.prompt_tokens = add_tokens(stats.prompt_tokens, prompt_tokens)
+            stats.response_tokens = add_tokens(stats.response_tokens, response_tokens)
+            stats.payload_bytes += payload_bytes
+            stats.prompt_chars += prompt_chars
+            if error:
+                stats.errors += 1
+                self._errors[(kind, error)] += 1
+            self._recent.append(record)
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, "a", encoding="utf-8") as fh:
+                    fh.write(json.dumps(record) + "\n")
+            except OSError:
+                pass
+
+    def summary(self):
+        """Per-kind counts, latency percentiles, token totals, error classes and cache stats"""
+        with self._lock:
+            kinds = {}
+            for kind, stats in self._kinds.items():
+                wall = sorted(stats.wall)
+                ttft = sorted(stats.ttft)
+                kinds[kind] = {
+                    "calls": stats.count,
+                    "errors": stats.errors,
+                    "wall_p50": percentile(wall, 0.5),
+                    "wall_p95": percentile(wall, 0.95),
+                    "wall_p99": percentile(wall, 0.99),
+                    "ttft_p50": percentile(ttft, 0.5),
+                    "ttft_p95": percentile(ttft, 0.95),
+                    "ttft_p99": percentile(ttft, 0.99),
+                    "prompt_tokens": stats.prompt_tokens,
+                    "response_tokens": stats.response_tokens,
+                    "payload_bytes": stats.payload_bytes,
+                    "avg_prompt_chars": stats.prompt_chars / stats.count if stats.count else 0,
+                }
+            errors = {f"{kind}:{error}": n for (kind, error), n in self._errors.items()}
+            retries = {f"{kind}:{error}": n for (kind, error), n in self._retries.items()}
+            caches = dict(self._caches)
+        return {
+            "calls": kinds,
+            "errors": errors,
+            "retries": retries,
+            "caches": {name: cache.stats() for name, cache in caches.items()},
+        }
+
+    def recent_jsonl(self):
+        """The most recent call records as JSON lines"""
+        with self._lock:
+            return "".join(json.dumps(record) + "\n" for record in self._recent)
+
+    def prometheus_text(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            kinds = {
+                kind: (stats.count, stats.wall_sum, sorted(stats.wall), sorted(stats.ttft),
+                       stats.prompt_tokens, stats.response_tokens, stats.payload_bytes)
+                for kind, stats in self._kinds.items()
+            }
+            errors = dict(self._errors)
+            retries = dict(self._retries)
+            caches = dict(self._caches)
+
+        lines = [
+            "# HELP insightflow_model_call_seconds Wall time of Gemini calls.",
+            "# TYPE insightflow_model_call_seconds summary",
+        ]
+        for kind, (count, wall_sum, wall, _ttft, _pt, _rt, _pb) in kinds.items():
+            for q in QUANTILES:
+                lines.append(f'insightflow_model_call_seconds{{kind="{kind}",quantile="{q}"}} {percentile(wall, q)}')
+            lines.append(f'insightflow_model_call_seconds_sum{{kind="{kind}"}} {wall_sum}')
+            lines.append(f'insightflow_model_call_seconds_count{{kind="{kind}"}} {count}')
+
+        lines += [
+            "# HELP insightflow_model_ttft_seconds Time to first streamed chunk.",
+            "# TYPE insightflow_model_ttft_seconds summary",
+        ]
+        for kind, (_count, _ws, _wall, ttft, _pt, _rt, _pb) in kinds.items():
+            if ttft:
+                for q in QUANTILES:
+                    lines.append(f'insightflow_model_ttft_seconds{{kind="{kind}",quantile="{q}"}} {percentile(ttft, q)}')
+                lines.append(f'insightflow_model_ttft_seconds_count{{kind="{kind}"}} {len(ttft)}')
+
+        lines += [
+            "# HELP insightflow_model_tokens_total Tokens reported by the SDK or count_tokens; absent when unknown.",
+            "# TYPE insightflow_model_tokens_total counter",
+        ]
+        for kind, (_count, _ws, _wall, _ttft, prompt_tokens, response_tokens, _pb) in kinds.items():
+            for direction, tokens in (("prompt", prompt_tokens), ("response", response_tokens)):
+                if tokens is not None:
+                    lines.append(f'insightflow_model_tokens_total{{kind="{kind}",direction="{direction}"}} {tokens}')
+
+        lines += [
+            "# HELP insightflow_model_payload_bytes_total Inline image bytes sent to Gemini.",
+            "# TYPE insightflow_model_payload_bytes_total counter",
+        ]
+        for kind, (_count, _ws, _wall, _ttft, _pt, _rt, payload) in kinds.items():
+            lines.append(f'insightflow_model_payload_bytes_total{{kind="{kind}"}} {payload}')
+
+        lines += [
+            "# HELP insightflow_model_errors_total Failed Gemini calls by error class.",
+            "# TYPE insightflow_model_errors_total counter",
+        ]
+        for (kind, error), n in errors.items():
+            lines.append(f'insightflow_model_errors_total{{kind="{kind}",error="{error}"}} {n}')
+
+        lines += [
+            "# HELP insightflow_model_retries_total Retried Gemini attempts by error class.",
+            "# TYPE insightflow_model_retries_total counter",
+        ]
+        for (kind, error), n in retries.items():
+            lines.append(f'insightflow_model_retries_total{{kind="{kind}",error="{error}"}} {n}')
+
+        lines += [
+            "# HELP insightflow_cache_lookups_total Cache lookups by result.",
+            "# TYPE insightflow_cache_lookups_total counter",
+        ]
+        for name, cache in caches.items():
+            stats = cache.stats()
+            lines.append(f'insightflow_cache_lookups_total{{cache="{name}",result="hit"}} {stats["hits"]}')
+            lines.append(f'insightflow_cache_lookups_total{{cache="{name}",result="miss"}} {stats["misses"]}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,84 @@
+"""Inverted index over learned diagnosis patterns"""
+import heapq
+from collections import Counter
+
+
+class PatternIndex:
+    """Maps equipment type to symptom/environment posting lists for top-k lookups.
+
+    PatternStats records are indexed by reference; call upsert() whenever
+    a pattern's counts change so memoized query results are invalidated.
+    """
+
+    MEMO_LIMIT = 1024
+
+    def __init__(self):
+        self._patterns = {}
+        self._by_equipment = {}
+        self._memo = {}
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def get(self, pattern_key, default=None):
+        """Return the stored pattern for pattern_key"""
+        return self._patterns.get(pattern_key, default)
+
+    def upsert(self, pattern_key, pattern):
+        """Index a new pattern or mark an existing one as updated"""
+        if pattern_key not in self._patterns:
+            self._patterns[pattern_key] = pattern
+            postings = self._by_equipment.setdefault(
+                pattern.equipment_type, {'symptoms': {}, 'environment': {}, 'all': {}}
+            )
+            postings['all'][pattern_key] = None
+            for field in ('symptoms', 'environment'):
+                for value in set(getattr(pattern, field)):
+                    postings[field].setdefault(value, {})[pattern_key] = None
+        self._memo.clear()
+
+    def query(self, equipment_type, symptoms, environment, k=2):
+        """Return the top-k patterns by shared symptoms + environment, then count.
+
+        Each result is the pattern's summary() dict with a
+        'similarity_score' field; stored patterns are never mutated.
+        """
+        memo_key = (equipment_type, frozenset(symptoms or ()), frozenset(environment or ()), k)
+        cached = self._memo.get(memo_key)
+        if cached is not None:
+            return list(cached)
+
+        postings = self._by_equipment.get(equipment_type)
+        results = []
+        if postings:
+            scores = Counter()
+            for field, values in (('symptoms', memo_key[1]), ('environment', memo_key[2])):
+                field_postings = postings[field]
+                for value in values:
+                    if value in field_postings:
+                        scores.update(field_postings[value].keys())
+
+            # Only patterns in the best score tiers can make the top-k, so rank
+            # those by count instead of sorting every candidate
+            candidates = []
+            for level in sorted(set(scores.values()), reverse=True):
+                candidates.extend(item for item in scores.items() if item[1] == level)
+                if len(candidates) >= k:
+                    break
+            patterns = self._patterns
+            top = heapq.nlargest(
+                k, candidates, key=lambda item: (item[1], patterns[item[0]].count)
+            )
+            results = [patterns[pattern_key].summary(similarity_score=score) for pattern_key, score in top]
+
+        if len(self._memo) >= self.MEMO_LIMIT:
+            self._memo.clear()
+        self._memo[memo_key] = tuple(results)
+        return results
+
+    def most_frequent(self, equipment_type, k=5):
+        """Summaries of the k most frequently seen patterns for an equipment type"""
+        keys = self._by_equipment.get(equipment_type, {}).get('all', {})
+        patterns = self._patterns
+        top = heapq.nlargest(k, keys, key=lambda pattern_key: patterns[pattern_key].count)
+        return [patterns[pattern_key].summary() for pattern_key in top]
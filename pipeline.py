@@ -0,0 +1,166 @@
+"""Diagnosis pipeline run off the script thread: image analyses and diagnosis jobs"""
+from concurrent.futures import as_completed
+from datetime import datetime
+
+import config
+from cache import make_key
+from prompts import build_diagnosis_contents, build_image_analysis_prompt, normalize_prompt
+from structured import split_structured_diagnosis, visible_report
+
+
+def analyze_image_with_gemini(image, equipment_type, context, client):
+    """Analyze image using Gemini Vision"""
+    try:
+        prompt = build_image_analysis_prompt(equipment_type, context)
+
+        response = client.generate([prompt, image.as_part()], kind="image_analysis")
+        return response.text
+
+    except Exception as e:
+        return f"❌ Image analysis failed: {str(e)}"
+
+def image_analysis_key(image_digest, equipment_type, severity):
+    """Cache key for one image analysed in a given case context"""
+    return make_key("image_analysis", config.MODEL_NAME, image_digest, equipment_type, severity)
+
+def analyze_on_upload(multimodal):
+    """Whether uploads are analyzed in the background as soon as they arrive.
+
+    Single-call diagnoses send the photos with the diagnosis itself, so
+    analyzing each photo first would only add a vision call per photo.
+    """
+    return config.IMAGE_ANALYSIS_MODE == "background" and not multimodal
+
+def analyze_images_concurrently(images, equipment_type, severity, queue):
+    """Analyze ProcessedImages on the shared analysis pool and wait for them.
+
+    Yields (index, analysis) as each result lands; cached analyses are
+    yielded first, jobs already queued in the background are joined
+    rather than repeated, and earlier failures are retried. Every job
+    waited on is claimed, so a later rerun that changes the form cannot
+    cancel it.
+    """
+    context = f"Equipment: {equipment_type}, Severity: {severity}"
+    pending = {}
+    claimed = []
+    try:
+        for i, image in enumerate(images):
+            key = image_analysis_key(image.digest, equipment_type, severity)
+            state, analysis = queue.lookup(key)
+            if state == "done":
+                yield i, analysis
+            else:
+                claimed.append(key)
+                pending[queue.submit(key, image, equipment_type, context, retry_failed=True, claim=True)] = i
+
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+    finally:
+        for key in claimed:
+            queue.release(key)
+
+def generate_diagnosis(client, contents, stream=False, on_partial=None, prompt_tokens=None):
+    """Run the diagnosis call, passing the report so far to on_partial as chunks arrive when streaming.
+
+    contents is the prompt text, or the prompt followed by inline images
+    in single-call multimodal mode. prompt_tokens, when measured, is
+    recorded with the call's metrics.
+    """
+    if not stream:
+        return client.generate(contents, kind="diagnosis", prompt_tokens=prompt_tokens).text
+
+    chunks = []
+    for chunk in client.generate(contents, stream=True, kind="diagnosis", prompt_tokens=prompt_tokens):
+        chunks.append(chunk.text)
+        if on_partial is not None:
+            # The trailing JSON block is parsed afterwards, not shown
+            on_partial(visible_report("".join(chunks)))
+    return "".join(chunks)
+
+def diagnosis_cache_key(prompt, image_digests):
+    """Cache key for a diagnosis: whitespace-normalized prompt plus image content digests.
+
+    The learned-insights block is dropped before hashing because its
+    pattern counts change after every case, which would otherwise make
+    a resubmitted case miss the cache.
+    """
+    return make_key("diagnosis", config.MODEL_NAME, normalize_prompt(prompt), *image_digests)
+
+def run_diagnosis_job(request, progress, client, knowledge_base, assembler, diagnosis_cache, analysis_queue):
+    """Full diagnosis pipeline for one request, run on the diagnosis job pool.
+
+    request holds the case fields and options captured when the diagnosis
+    was requested; the returned dict is stored with the job. The shared
+    resources are passed in by resources.get_diagnosis_jobs().
+    """
+    case_inputs = request['case']
+    images = request['images']
+    equipment_type = case_inputs['equipment_type']
+    severity = case_inputs['severity']
+
+    # Deferred analyses are joined here; finished ones come straight from the cache
+    image_analysis_results = request['image_analysis_results']
+    if request['multimodal']:
+        image_analysis_results = []
+    elif image_analysis_results is None:
+        progress(stage="Analyzing images")
+        image_analysis_results = [None] * len(images)
+        for slot, analysis in analyze_images_concurrently(images, equipment_type, severity, analysis_queue):
+            image_analysis_results[slot] = analysis
+
+    # Prompt with learned insights and image analysis
+    progress(stage="Preparing the prompt")
+    similar_cases = knowledge_base.similar_cases(case_inputs['issue_description'], equipment_type,
+                                                 k=config.RETRIEVAL_TOP_K)
+    insights = knowledge_base.get_learned_insights(equipment_type, case_inputs['symptoms'],
+                                                   case_inputs['environment'], k=2)
+    prompt, prompt_report = assembler.assemble(
+        case_inputs,
+        insights,
+        image_analysis_results,
+        expert_mode=request['expert_mode'],
+        attached_images=len(images) if request['multimodal'] else 0,
+        similar_cases=similar_cases,
+        structured_output=bool(config.STRUCTURED_DIAGNOSIS)
+    )
+    diagnosis_contents = prompt
+    # The assembler counted the prompt text; attached images are not in that count
+    measured_tokens = prompt_report['tokens'] if prompt_report['exact'] else None
+    if request['multimodal'] and images:
+        diagnosis_contents = build_diagnosis_contents(prompt, [image.as_part() for image in images])
+        measured_tokens = None
+
+    cache_key = diagnosis_cache_key(prompt, [image.digest for image in images])
+    diagnosis_text = None if request['bypass_cache'] else diagnosis_cache.get(cache_key)
+    served_from_cache = diagnosis_text is not None
+    if not served_from_cache:
+        progress(stage="Writing the diagnosis")
+        diagnosis_text = generate_diagnosis(client, diagnosis_contents, stream=request['stream'],
+                                            on_partial=lambda text: progress(partial=text),
+                                            prompt_tokens=measured_tokens)
+        diagnosis_cache.set(cache_key, diagnosis_text)
+    # Parsed once here; everything after uses the report and the validated fields
+    diagnosis_text, structured = split_structured_diagnosis(diagnosis_text)
+
+    # Store case data
+    case_data = dict(
+        case_inputs,
+        timestamp=datetime.now().isoformat(),
+        diagnosis=diagnosis_text,
+        structured=structured,
+        prompt_tokens=prompt_report['tokens'],
+        expert_mode=request['expert_mode'],
+        has_images=case_inputs['images_count'] > 0
+    )
+    knowledge_base.record_case(case_data)
+
+    # Learn from this case
+    knowledge_base.learn_from_case(equipment_type, case_inputs['symptoms'], case_inputs['environment'], diagnosis_text,
+                                   severity, case_data['has_images'], issue_description=case_inputs['issue_description'],
+                                   case_id=case_data['id'], structured=structured)
+    return {
+        'case': case_data,
+        'served_from_cache': served_from_cache,
+        'learning_applied': bool(similar_cases or insights),
+        'prompt_report': prompt_report
+    }
@@ -0,0 +1,208 @@
+"""Prompt templates shared by the Streamlit app and the batch runner"""
+import re
+
+from structured import STRUCTURED_OUTPUT_INSTRUCTIONS
+
+LEARNING_SECTION_HEADER = "🎯 **LEARNED INSIGHTS FROM SIMILAR CASES:**"
+LEARNING_SECTION_FOOTER = "Consider these patterns in your analysis."
+LEARNING_SECTION_RE = re.compile(re.escape(LEARNING_SECTION_HEADER) + ".*?" + re.escape(LEARNING_SECTION_FOOTER), re.DOTALL)
+
+EXPERT_INSTRUCTIONS = """
+    As an expert maintenance engineer with 20+ years of experience, provide a COMPREHENSIVE technical analysis:
+
+    1. INTEGRATED ANALYSIS:
+       - Combine visual evidence from images with described symptoms
+       - Root cause identification considering all available data
+       - Failure mechanism analysis
+
+    2. TECHNICAL DIAGNOSIS:
+       - Step-by-step verification procedure
+       - Required diagnostic tools and measurements
+       - Correlation between visual signs and performance issues
+
+    3. REPAIR PROCEDURE:
+       - Detailed step-by-step instructions
+       - Required tools and equipment
+       - Replacement parts with specifications
+       - Integration of visual findings with repair steps
+
+    4. SAFETY PROTOCOLS:
+       - Lockout/tagout requirements
+       - Personal protective equipment
+       - Hazardous material handling
+       - Emergency procedures
+
+    5. TIME & COST ESTIMATION:
+       - Labor hours breakdown
+       - Parts cost estimation
+       - Total repair timeline
+
+    6. PREVENTION & MAINTENANCE:
+       - Preventive maintenance schedule
+       - Visual inspection guidelines
+       - Early warning signs
+       - Spare parts recommendation
+
+    Format with clear technical headings and bullet points.
+    Integrate image findings throughout your analysis.
+    """
+
+# Used instead of EXPERT_INSTRUCTIONS when the prompt is over its token budget
+COMPACT_EXPERT_INSTRUCTIONS = """
+    As an expert maintenance engineer, give a comprehensive technical analysis with clear headings and bullet points:
+    1. Integrated analysis: root cause and failure mechanism from the images and symptoms
+    2. Technical diagnosis: verification steps, tools and measurements
+    3. Repair procedure: steps, tools, replacement parts with specifications
+    4. Safety protocols: lockout/tagout, PPE, hazardous materials, emergency procedures
+    5. Time & cost: labor hours, parts cost, timeline
+    6. Prevention: maintenance schedule, inspection guidelines, early warning signs, spare parts
+    """
+
+STANDARD_INSTRUCTIONS = """
+    As a maintenance expert, provide a clear and practical diagnosis:
+
+    1. COMBINED ASSESSMENT: Integrate image findings with described issues
+    2. LIKELY CAUSE: What's probably wrong based on all evidence
+    3. QUICK CHECKS: Simple things to verify first  
+    4. REPAIR STEPS: Step-by-step fix incorporating visual clues
+    5. TOOLS NEEDED: What you'll need
+    6. SAFETY FIRST: Important warnings
+    7. TIME & COST: Rough estimates
+    8. PREVENTION: How to avoid future issues
+
+    Use simple language and focus on actionable steps.
+    Reference image findings where relevant.
+    """
+
+
+def build_image_analysis_prompt(equipment_type, context):
+    """Prompt for the per-image vision analysis"""
+    return f"""
+    Analyze this {equipment_type} image for maintenance issues.
+    
+    Context: {context}
+    
+    Please identify:
+    1. Visible damage, wear, or faults
+    2. Potential safety hazards
+    3. Components that may need repair/replacement
+    4. Any unusual conditions or patterns
+    5. Urgency level (Low/Medium/High/Critical)
+    
+    Provide specific, actionable observations.
+    """
+
+
+def build_base_prompt(equipment_type, severity, urgency, environment, symptoms, images_count, issue_description):
+    """Case header and description that every diagnosis prompt starts with"""
+    return f"""
+    MAINTENANCE DIAGNOSIS REQUEST
+
+    EQUIPMENT: {equipment_type}
+    SEVERITY: {severity}
+    URGENCY: {urgency}
+    ENVIRONMENT: {', '.join(environment) if environment else 'Normal'}
+    SYMPTOMS: {', '.join(symptoms) if symptoms else 'Not specified'}
+    IMAGES UPLOADED: {images_count} image(s)
+
+    ISSUE DESCRIPTION:
+    {issue_description}
+    """
+
+
+def combine_image_analyses(image_analysis_results):
+    """Join per-image analyses into the summary block used in the diagnosis prompt"""
+    if not image_analysis_results:
+        return ""
+    return "IMAGE ANALYSIS SUMMARY:\n" + "\n".join([f"Image {i+1}: {analysis}" for i, analysis in enumerate(image_analysis_results)])
+
+
+def attached_images_section(images_count):
+    """Instructions for images sent inline with the diagnosis request instead of pre-analyzed"""
+    if not images_count:
+        return ""
+    return f"""\n\n📷 **ATTACHED IMAGES:** {images_count} photo(s) of the equipment follow this request, labelled Image 1 to Image {images_count}.
+    For each image note visible damage, wear or faults, safety hazards, components needing repair and an urgency level,
+    then integrate these visual observations with the text description."""
+
+
+def learning_section(insights, similar_cases=None):
+    """Learned patterns and similar past cases, wrapped in the block normalize_prompt() drops"""
+    if not insights and not similar_cases:
+        return ""
+    section = f"\n\n{LEARNING_SECTION_HEADER}\n"
+    for i, insight in enumerate(insights or (), 1):
+        section += f"""
+            Pattern #{i} (Seen {insight['count']} times):
+            • Common Issues: {', '.join(insight['common_issues'][:3])}
+            • Typical Severity: {max(insight['severity_dist'].items(), key=lambda x: x[1])[0]}
+            • Similar Symptoms: {', '.join(insight['symptoms'])}
+            """
+    for case in similar_cases or ():
+        section += f"""
+            Similar Past Case (similarity {case['similarity_score']:.2f}, {case['severity']} severity):
+            • Description: {case['issue_description']}
+            • Issues Found: {', '.join(case['key_issues'][:3]) or 'Not recorded'}
+            """
+    return section + f"\n{LEARNING_SECTION_FOOTER}"
+
+
+def image_analysis_section(image_analysis):
+    """Pre-computed image findings (see combine_image_analyses)"""
+    if not image_analysis:
+        return ""
+    return f"\n\n📷 **IMAGE ANALYSIS RESULTS:**\n{image_analysis}\n\nIntegrate these visual observations with the text description."
+
+
+def diagnosis_prompt_sections(case, insights, image_analysis_results=(), expert_mode=False, attached_images=0,
+                              similar_cases=None, structured_output=False, compact_instructions=False):
+    """[(name, text), ...] making up the diagnosis prompt, in order.
+
+    Joined with no separator they give build_diagnosis_prompt(); the
+    prompt budget (see budget.py) rebuilds individual sections from
+    trimmed inputs. compact_instructions swaps the long expert template
+    for COMPACT_EXPERT_INSTRUCTIONS.
+    """
+    if expert_mode:
+        instructions = COMPACT_EXPERT_INSTRUCTIONS if compact_instructions else EXPERT_INSTRUCTIONS
+    else:
+        instructions = STANDARD_INSTRUCTIONS
+    return [
+        ("case", build_base_prompt(
+            case['equipment_type'], case['severity'], case['urgency'], case['environment'],
+            case['symptoms'], case.get('images_count', 0), case['issue_description']
+        )),
+        ("learning", learning_section(insights, similar_cases)),
+        ("images", image_analysis_section(combine_image_analyses(image_analysis_results))),
+        ("attached_images", attached_images_section(attached_images)),
+        ("instructions", instructions),
+        ("structured_output", STRUCTURED_OUTPUT_INSTRUCTIONS if structured_output else ""),
+    ]
+
+
+def build_diagnosis_prompt(case, insights, image_analysis_results=(), expert_mode=False, attached_images=0,
+                           similar_cases=None, structured_output=False):
+    """Assemble the full diagnosis prompt for a case dict.
+
+    attached_images is the number of images sent inline with the prompt
+    (see build_diagnosis_contents) rather than as pre-computed analyses.
+    similar_cases come from KnowledgeBase.similar_cases(). With
+    structured_output the answer ends in a JSON block that
+    structured.split_structured_diagnosis() separates from the report.
+    """
+    sections = diagnosis_prompt_sections(case, insights, image_analysis_results, expert_mode, attached_images,
+                                         similar_cases, structured_output)
+    return "".join(text for _name, text in sections)
+
+
+def build_diagnosis_contents(prompt, image_parts):
+    """generate_content contents for a single-call multimodal diagnosis: the prompt, then each labelled image"""
+    contents = [prompt]
+    for i, part in enumerate(image_parts, 1):
+        contents += [f"Image {i}:", part]
+    return contents
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace and drop the learned-insights block, whose counts change every case"""
+    return " ".join(LEARNING_SECTION_RE.sub("", prompt).split())
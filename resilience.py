@@ -0,0 +1,149 @@
+"""Rate limiting and retry helpers for Gemini calls"""
+import random
+import threading
+import time
+
+# HTTP statuses worth retrying: quota exhaustion and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursting up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute, burst=None):
+        return cls(requests_per_minute / 60.0, burst)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1.0, timeout=None):
+        """Block until tokens are available; return False if timeout expires first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+def is_retryable(exc):
+    """True for quota (429) and transient 5xx/network failures"""
+    code = getattr(exc, "code", None)
+    if callable(code):
+        try:
+            code = code()
+        except Exception:
+            code = None
+    if isinstance(code, int) and code in RETRYABLE_STATUS:
+        return True
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Full-jitter exponential backoff delay for a zero-based attempt number"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when a call waited longer than allowed for a rate-limit token"""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the service while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for `reset_timeout` seconds after
+    `failure_threshold` consecutive retryable failures, then lets a single
+    trial call through before closing again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_in_flight:
+                raise CircuitOpenError(
+                    f"Gemini is failing repeatedly; pausing calls for {max(remaining, 1):.0f}s"
+                )
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def call_with_retry(fn, *args, max_attempts=5, base_delay=1.0, max_delay=30.0, limiter=None,
+                    limiter_timeout=None, breaker=None, on_retry=None, **kwargs):
+    """Call fn, retrying retryable failures with jittered exponential backoff.
+
+    Each attempt first takes a token from limiter (if given) and checks
+    breaker (if given). Only retryable failures count towards the breaker;
+    any other response shows the service is reachable and resets it.
+    """
+    for attempt in range(max_attempts):
+        if limiter is not None and not limiter.acquire(timeout=limiter_timeout):
+            raise RateLimitTimeout("Timed out waiting for Gemini quota; too many requests are queued")
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            retryable = is_retryable(exc)
+            if breaker is not None:
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if attempt == max_attempts - 1 or not retryable:
+                raise
+            if on_retry is not None:
+                on_retry(exc)
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
@@ -0,0 +1,104 @@
+"""Process-wide resources shared by every session, created once per server process.
+
+The factories live here rather than in app.py: the script is re-executed
+on every interaction, and each pass would otherwise re-decorate (and
+re-hash the source of) every factory before the cache could answer.
+"""
+import atexit
+import functools
+
+import streamlit as st
+
+import config
+from analysis_queue import AnalysisQueue
+from budget import PromptAssembler
+from cache import ResultCache
+from gemini_client import GeminiClient
+from jobs import DiagnosisJobs
+from knowledge import KnowledgeBase
+from metrics import MetricsRegistry
+from pipeline import analyze_image_with_gemini, run_diagnosis_job
+from storage import KnowledgeStore
+
+
+@st.cache_resource
+def get_metrics():
+    """Model-call latency, token and error metrics for the whole process"""
+    return MetricsRegistry(window=config.METRICS_WINDOW, jsonl_path=config.METRICS_JSONL_PATH)
+
+@st.cache_resource
+def get_gemini_client():
+    """Gemini client shared by every session so the quota and circuit breaker are process-wide"""
+    return GeminiClient(metrics=get_metrics())
+
+@st.cache_resource
+def get_analysis_cache():
+    """Per-image Gemini analysis cache keyed by image content and case context"""
+    cache = ResultCache(
+        max_entries=config.ANALYSIS_CACHE_SIZE,
+        ttl_seconds=config.ANALYSIS_CACHE_TTL,
+        disk_dir=config.ANALYSIS_CACHE_DIR
+    )
+    get_metrics().register_cache("image_analysis", cache)
+    return cache
+
+@st.cache_resource
+def get_analysis_queue():
+    """Process-wide image analysis pool; results outlive the rerun that queued them"""
+    # The client is bound here: cached factories log a warning when called from pool threads
+    return AnalysisQueue(functools.partial(analyze_image_with_gemini, client=get_gemini_client()),
+                         get_analysis_cache(), max_workers=config.ANALYSIS_CONCURRENCY)
+
+@st.cache_resource
+def get_image_cache():
+    """Preprocessed images memoized by content hash and output settings"""
+    cache = ResultCache(max_entries=config.IMAGE_CACHE_SIZE, ttl_seconds=config.IMAGE_CACHE_TTL)
+    get_metrics().register_cache("preprocessed_image", cache)
+    return cache
+
+@st.cache_resource
+def get_diagnosis_cache():
+    """Full diagnosis cache keyed by the normalized final prompt, persisted to disk"""
+    cache = ResultCache(
+        max_entries=config.DIAGNOSIS_CACHE_SIZE,
+        ttl_seconds=config.DIAGNOSIS_CACHE_TTL,
+        disk_dir=config.DIAGNOSIS_CACHE_DIR
+    )
+    get_metrics().register_cache("diagnosis", cache)
+    return cache
+
+@st.cache_resource
+def get_prompt_assembler():
+    """Token-budgeted prompt assembly, with token counts and compacted image findings cached by hash"""
+    cache = ResultCache(max_entries=config.PROMPT_FRAGMENT_CACHE_SIZE)
+    get_metrics().register_cache("prompt_fragments", cache)
+    return PromptAssembler(get_gemini_client().count_tokens, config.PROMPT_TOKEN_BUDGET, cache)
+
+@st.cache_resource
+def get_knowledge_base():
+    """Learned patterns and case history shared by every session, persisted to SQLite"""
+    store = KnowledgeStore(
+        config.KNOWLEDGE_DB_PATH,
+        batch_size=config.KNOWLEDGE_WRITE_BATCH,
+        flush_interval=config.KNOWLEDGE_FLUSH_INTERVAL
+    )
+    atexit.register(store.close)
+    knowledge_base = KnowledgeBase(store, retrieval_dimensions=config.RETRIEVAL_DIMENSIONS)
+    # Build the similar-case index off the request path
+    knowledge_base.warm_case_vectors()
+    return knowledge_base
+
+@st.cache_resource
+def get_diagnosis_jobs():
+    """Diagnosis worker pool shared by every session; jobs are recorded in the knowledge base"""
+    # Shared resources are resolved on this script thread and bound into the job runner
+    run = functools.partial(
+        run_diagnosis_job,
+        client=get_gemini_client(),
+        knowledge_base=get_knowledge_base(),
+        assembler=get_prompt_assembler(),
+        diagnosis_cache=get_diagnosis_cache(),
+        analysis_queue=get_analysis_queue()
+    )
+    return DiagnosisJobs(run, get_knowledge_base().store, max_workers=config.DIAGNOSIS_WORKERS,
+                         retention=config.JOB_RETENTION)
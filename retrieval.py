@@ -0,0 +1,183 @@
+"""Hashed TF-IDF retrieval over past case descriptions and diagnoses"""
+import re
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+# Document frequencies are tracked per hashed term in a table of 2**DF_BITS buckets
+DF_BITS = 20
+DF_MASK = (1 << DF_BITS) - 1
+# Dropped before hashing: they carry no signal and only add collision noise
+STOP_WORDS = frozenset(
+    "a an and are as at be been but by for from has have in is it its of on or that the this to was were "
+    "when which while with i we our my there after before then than so if not no".split()
+)
+
+
+def tokenize(text):
+    """Lowercase word tokens (keeping codes like E-42 or 3/4 whole) plus word bigrams"""
+    words = [word for word in TOKEN_RE.findall(text.lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def term_counts(text):
+    """Map 32-bit term hashes to their counts in text"""
+    return {zlib.crc32(token.encode("utf-8")): count for token, count in Counter(tokenize(text)).items()}
+
+
+# Capacity of an equipment type's rows grows by this factor, so a resize briefly holds 2.25x its rows, not 3x
+GROWTH_FACTOR = 1.25
+# Quantized rows are widened to float32 this many at a time, a block small enough to stay in cache
+SCAN_ROWS = 512
+
+
+class _EquipmentRows:
+    """The quantized vectors, row scales and records of one equipment type, grown in place"""
+
+    def __init__(self, dimensions, capacity):
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.int8)
+        self.scales = np.zeros(capacity, dtype=np.float32)
+        self.records = []
+
+    def extend(self, vectors, scales, records):
+        start = len(self.records)
+        end = start + len(records)
+        if end > len(self.vectors):
+            capacity = max(end, int(len(self.vectors) * GROWTH_FACTOR))
+            grown = np.zeros((capacity, self.vectors.shape[1]), dtype=np.int8)
+            grown[:start] = self.vectors[:start]
+            grown_scales = np.zeros(capacity, dtype=np.float32)
+            grown_scales[:start] = self.scales[:start]
+            self.vectors, self.scales = grown, grown_scales
+        self.vectors[start:end] = vectors
+        self.scales[start:end] = scales
+        self.records.extend(records)
+
+    def scores(self, queries):
+        """(rows, len(queries)) cosine scores against float32 query vectors"""
+        rows = len(self.records)
+        scores = np.empty((rows, len(queries)), dtype=np.float32)
+        for start in range(0, rows, SCAN_ROWS):
+            end = min(rows, start + SCAN_ROWS)
+            scores[start:end] = self.vectors[start:end].astype(np.float32) @ queries.T
+        scores *= self.scales[:rows, None]
+        return scores
+
+
+class CaseVectorIndex:
+    """L2-normalized hashed TF-IDF vectors with batched top-k cosine search.
+
+    Each term hash picks a signed column out of `dimensions`, so the
+    matrix stays a fixed width however large the vocabulary grows.
+    Collisions add noise of roughly 1/sqrt(dimensions) to each cosine
+    score; at 1024 columns that is ~0.03. Rows are stored as int8 with
+    one float32 scale each (1 KB per case at 1024 columns, rounding
+    error under 0.01) and kept per equipment type, so a filtered query
+    only scans that type's rows. IDF weights come from document
+    frequencies at the time a case (or a chunk of add_many) is added;
+    rows are never rewritten, which keeps adds O(terms) while queries
+    always use the current IDF.
+    """
+
+    def __init__(self, dimensions=1024, initial_capacity=256):
+        self.dimensions = dimensions
+        self.initial_capacity = max(1, initial_capacity)
+        # equipment type -> _EquipmentRows
+        self._rows = {}
+        self._size = 0
+        self._doc_freq = np.zeros(1 << DF_BITS, dtype=np.int32)
+        self._documents = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _vectorize(self, documents):
+        """(len(documents), dimensions) matrix for [(terms, tf), ...] under the current IDF"""
+        sizes = [len(terms) for terms, _tf in documents]
+        if not sum(sizes):
+            return np.zeros((len(documents), self.dimensions), dtype=np.float32)
+        terms = np.concatenate([terms for terms, _tf in documents])
+        tf = np.concatenate([tf for _terms, tf in documents])
+        rows = np.repeat(np.arange(len(documents)), sizes)
+        idf = np.log((1.0 + self._documents) / (1.0 + self._doc_freq[terms & DF_MASK])) + 1.0
+        weights = np.where(terms >> 31, -tf, tf) * idf
+        cells = rows * self.dimensions + (terms >> 8) % self.dimensions
+        matrix = np.bincount(cells, weights, minlength=len(documents) * self.dimensions)
+        matrix = matrix.reshape(len(documents), self.dimensions).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @staticmethod
+    def _terms(text):
+        counts = term_counts(text)
+        terms = np.fromiter(counts.keys(), dtype=np.uint32, count=len(counts))
+        tf = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+        return terms, tf
+
+    def add(self, text, record, equipment_type=None):
+        """Index one case; record is returned as-is by search()"""
+        self.add_many([(text, record, equipment_type)])
+
+    def add_many(self, entries, chunk_size=2048):
+        """Index (text, record, equipment_type) entries, vectorizing chunk_size rows per matrix op"""
+        chunk = []
+        for text, record, equipment_type in entries:
+            terms, tf = self._terms(text)
+            if len(terms):
+                chunk.append((terms, tf, record, equipment_type))
+            if len(chunk) >= chunk_size:
+                self._append(chunk)
+                chunk = []
+        if chunk:
+            self._append(chunk)
+
+    def _append(self, chunk):
+        with self._lock:
+            np.add.at(self._doc_freq, np.concatenate([terms for terms, *_ in chunk]) & DF_MASK, 1)
+            self._documents += len(chunk)
+            matrix = self._vectorize([(terms, tf) for terms, tf, *_ in chunk])
+            peaks = np.abs(matrix).max(axis=1)
+            peaks[peaks == 0] = 1.0
+            quantized = np.rint(matrix * (127.0 / peaks[:, None])).astype(np.int8)
+            scales = peaks / 127.0
+            by_type = {}
+            for row, (*_, equipment_type) in enumerate(chunk):
+                by_type.setdefault(equipment_type, []).append(row)
+            for equipment_type, rows in by_type.items():
+                group = self._rows.get(equipment_type)
+                if group is None:
+                    group = self._rows[equipment_type] = _EquipmentRows(self.dimensions, self.initial_capacity)
+                group.extend(quantized[rows], scales[rows], [chunk[row][2] for row in rows])
+            self._size += len(chunk)
+
+    def search(self, texts, k=3, equipment_type=None, min_score=0.15):
+        """Return [(score, record), ...] best-first for each query text.
+
+        All queries are scored together, one matrix product per block of
+        rows; equipment_type restricts matches to that type, and only its
+        rows are scored.
+        """
+        with self._lock:
+            if not self._size or not texts:
+                return [[] for _ in texts]
+            if equipment_type is None:
+                groups = list(self._rows.values())
+            elif equipment_type in self._rows:
+                groups = [self._rows[equipment_type]]
+            else:
+                return [[] for _ in texts]
+            queries = self._vectorize([self._terms(text) for text in texts])
+            scored = [(group.scores(queries), group.records) for group in groups]
+
+        results = [[] for _ in texts]
+        for scores, records in scored:
+            top_k = min(k, len(scores))
+            for matches, column in zip(results, scores.T):
+                top = np.argpartition(-column, top_k - 1)[:top_k]
+                matches.extend((float(column[i]), records[i]) for i in top if column[i] >= min_score)
+        return [sorted(matches, key=lambda match: -match[0])[:k] for matches in results]
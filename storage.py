@@ -0,0 +1,272 @@
+"""SQLite persistence for diagnosis history, learned patterns, equipment insights and diagnosis jobs"""
+import json
+import sqlite3
+import threading
+
+from aggregates import EquipmentStats, PatternStats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    equipment_type TEXT NOT NULL,
+    severity TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cases_equipment ON cases (equipment_type, timestamp);
+
+CREATE TABLE IF NOT EXISTS patterns (
+    pattern_key TEXT PRIMARY KEY,
+    equipment_type TEXT NOT NULL,
+    symptom_key TEXT NOT NULL,
+    env_key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_patterns_equipment ON patterns (equipment_type, symptom_key, env_key);
+CREATE INDEX IF NOT EXISTS idx_patterns_env ON patterns (equipment_type, env_key);
+
+CREATE TABLE IF NOT EXISTS equipment_insights (
+    equipment_type TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, submitted_at);
+"""
+
+# Job states that are still waiting for or holding a worker
+UNFINISHED_JOB_STATES = ("queued", "running")
+
+
+class KnowledgeStore:
+    """SQLite store in WAL mode, safe to share between processes.
+
+    Cases are inserted as they are recorded and take their IDs from
+    SQLite, so two processes never hand out the same ID. Pattern and
+    equipment updates are queued as deltas (PatternStats/EquipmentStats
+    holding only this process's new observations) and merged into the
+    stored rows in a single write transaction once batch_size rows are
+    pending or flush_interval seconds have passed, so concurrent writers
+    add to each other's counts instead of overwriting them. Reads only
+    see committed rows, so callers track live counts themselves.
+    """
+
+    def __init__(self, path, batch_size=50, flush_interval=2.0):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        # pattern_key -> (symptom_key, env_key, PatternStats delta); equipment_type -> EquipmentStats delta
+        self._pending_patterns = {}
+        self._pending_insights = {}
+        self._timer = None
+
+    # Reads
+    def case_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    def max_case_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM cases").fetchone()[0]
+
+    def pattern_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM patterns").fetchone()[0]
+
+    def load_patterns(self, equipment_type):
+        """Return {pattern_key: pattern} for one equipment type"""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pattern_key, data FROM patterns WHERE equipment_type = ?",
+                (equipment_type,)
+            ).fetchall()
+        return {pattern_key: json.loads(data) for pattern_key, data in rows}
+
+    def load_equipment_insights(self):
+        """Return {equipment_type: insight} for every equipment type"""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute("SELECT equipment_type, data FROM equipment_insights").fetchall()
+        return {equipment_type: json.loads(data) for equipment_type, data in rows}
+
+    def iter_patterns(self, page_size=500):
+        """Yield (pattern_key, pattern) for every stored pattern, one page at a time"""
+        self.flush()
+        last_key = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT pattern_key, data FROM patterns WHERE pattern_key > ? ORDER BY pattern_key LIMIT ?",
+                    (last_key, page_size)
+                ).fetchall()
+            if not rows:
+                break
+            for pattern_key, data in rows:
+                yield pattern_key, json.loads(data)
+            last_key = rows[-1][0]
+
+    def iter_cases(self, page_size=500, oldest_first=False):
+        """Yield stored cases newest first (or oldest first), one page at a time"""
+        self.flush()
+        last_id = None
+        while True:
+            query = "SELECT id, data FROM cases"
+            params = []
+            if last_id is not None:
+                query += " WHERE id > ?" if oldest_first else " WHERE id < ?"
+                params.append(last_id)
+            query += " ORDER BY id ASC LIMIT ?" if oldest_first else " ORDER BY id DESC LIMIT ?"
+            params.append(page_size)
+            with self._lock:
+                rows = self._conn.execute(query, params).fetchall()
+            if not rows:
+                break
+            for case_id, data in rows:
+                yield dict(json.loads(data), id=case_id)
+            last_id = rows[-1][0]
+
+    # Writes
+    def insert_cases(self, cases):
+        """Store cases in one transaction, setting each one's 'id' to the row ID SQLite assigned"""
+        rows = [
+            (case['timestamp'], case['equipment_type'], case.get('severity'),
+             json.dumps({key: value for key, value in case.items() if key != 'id'}))
+            for case in cases
+        ]
+        with self._lock, self._conn:
+            for case, row in zip(cases, rows):
+                cursor = self._conn.execute(
+                    "INSERT INTO cases (timestamp, equipment_type, severity, data) VALUES (?, ?, ?, ?)", row
+                )
+                case['id'] = cursor.lastrowid
+        return [case['id'] for case in cases]
+
+    def queue_pattern(self, pattern_key, symptom_key, env_key, delta):
+        """Queue a PatternStats delta to add to the stored pattern; the store takes ownership of it"""
+        with self._lock:
+            pending = self._pending_patterns.get(pattern_key)
+            if pending is None:
+                self._pending_patterns[pattern_key] = (symptom_key, env_key, delta)
+            else:
+                pending[2].merge(delta)
+        self._maybe_flush()
+
+    def queue_equipment_insight(self, equipment_type, delta):
+        """Queue an EquipmentStats delta to add to the stored insight; the store takes ownership of it"""
+        with self._lock:
+            pending = self._pending_insights.get(equipment_type)
+            if pending is None:
+                self._pending_insights[equipment_type] = delta
+            else:
+                pending.merge(delta)
+        self._maybe_flush()
+
+    def _pending_count(self):
+        return len(self._pending_patterns) + len(self._pending_insights)
+
+    def _maybe_flush(self):
+        with self._lock:
+            if self._pending_count() >= self.batch_size:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Commit every queued write in one transaction"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending_count():
+                return
+            with self._conn:
+                # Take the write lock before reading, so no other process can update a row between our read and write
+                self._conn.execute("BEGIN IMMEDIATE")
+                pattern_rows = []
+                for pattern_key, (symptom_key, env_key, delta) in self._pending_patterns.items():
+                    stored = self._conn.execute(
+                        "SELECT data FROM patterns WHERE pattern_key = ?", (pattern_key,)
+                    ).fetchone()
+                    pattern = delta
+                    if stored is not None:
+                        pattern = PatternStats.from_dict(json.loads(stored[0]))
+                        pattern.merge(delta)
+                    pattern_rows.append((pattern_key, pattern.equipment_type, symptom_key, env_key, pattern.count,
+                                         json.dumps(pattern.to_dict())))
+                insight_rows = []
+                for equipment_type, delta in self._pending_insights.items():
+                    stored = self._conn.execute(
+                        "SELECT data FROM equipment_insights WHERE equipment_type = ?", (equipment_type,)
+                    ).fetchone()
+                    insight = delta
+                    if stored is not None:
+                        insight = EquipmentStats.from_dict(json.loads(stored[0]))
+                        insight.merge(delta)
+                    insight_rows.append((equipment_type, json.dumps(insight.to_dict())))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO patterns (pattern_key, equipment_type, symptom_key, env_key, count, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    pattern_rows
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO equipment_insights (equipment_type, data) VALUES (?, ?)",
+                    insight_rows
+                )
+            self._pending_patterns.clear()
+            self._pending_insights.clear()
+
+    # Jobs are written through rather than batched: a finished job must be
+    # readable by the session polling for it straight away
+    def save_job(self, job):
+        row = (job['id'], job['status'], job['submitted_at'], json.dumps(job))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, submitted_at, data) VALUES (?, ?, ?, ?)", row
+            )
+
+    def load_job(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def fail_unfinished_jobs(self, error):
+        """Mark jobs left queued or running by a previous process as failed; returns how many"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"SELECT data FROM jobs WHERE status IN ({', '.join('?' * len(UNFINISHED_JOB_STATES))})",
+                UNFINISHED_JOB_STATES
+            ).fetchall()
+            for (data,) in rows:
+                job = dict(json.loads(data), status="failed", error=error, error_type="Interrupted")
+                self._conn.execute("UPDATE jobs SET status = ?, data = ? WHERE job_id = ?",
+                                   (job['status'], json.dumps(job), job['id']))
+        return len(rows)
+
+    def prune_jobs(self, submitted_before):
+        """Delete job records submitted before the given epoch time"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE submitted_at < ?", (submitted_before,))
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,81 @@
+"""Structured diagnosis fields returned alongside the markdown report"""
+import json
+import re
+
+URGENCY_LEVELS = ("Low", "Medium", "High", "Critical")
+LIST_FIELDS = ("root_causes", "parts", "steps", "safety")
+MAX_ITEMS = 10
+MAX_ITEM_CHARS = 200
+
+# The model appends the JSON after the report; the opening fence marks where the report ends
+JSON_FENCE = "```json"
+JSON_BLOCK_RE = re.compile(r"```json\s*(\{.*\})\s*```\s*$", re.DOTALL)
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = f"""
+    After the report, end your answer with a single JSON object inside a ```json fenced block and nothing after it.
+    Use exactly these keys:
+    {{"root_causes": [most likely cause first], "urgency": one of {', '.join(f'"{level}"' for level in URGENCY_LEVELS)},
+     "parts": [replacement parts], "steps": [repair steps in order], "safety": [safety precautions]}}
+    Every list item must be a short phrase of at most 12 words.
+    """
+
+
+class StructuredDiagnosisError(ValueError):
+    """The structured block is missing or does not match the schema"""
+
+
+def _clean_list(value, field):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        raise StructuredDiagnosisError(f"'{field}' must be a list")
+    items = []
+    for item in value:
+        if not isinstance(item, str):
+            raise StructuredDiagnosisError(f"'{field}' items must be strings")
+        item = " ".join(item.split())[:MAX_ITEM_CHARS]
+        if item and item not in items:
+            items.append(item)
+    return items[:MAX_ITEMS]
+
+
+def validate_structured_diagnosis(data):
+    """Return a normalized copy of data, raising StructuredDiagnosisError if it doesn't fit the schema"""
+    if not isinstance(data, dict):
+        raise StructuredDiagnosisError("structured diagnosis must be a JSON object")
+    result = {field: _clean_list(data.get(field), field) for field in LIST_FIELDS}
+    if not result['root_causes']:
+        raise StructuredDiagnosisError("'root_causes' must not be empty")
+    urgency = data.get('urgency')
+    result['urgency'] = next(
+        (level for level in URGENCY_LEVELS if isinstance(urgency, str) and urgency.strip().lower() == level.lower()),
+        None
+    )
+    return result
+
+
+def split_structured_diagnosis(text):
+    """Split a model answer into (markdown report, validated fields or None).
+
+    Answers without a valid trailing JSON block are returned unchanged
+    with None, so callers can fall back to the free-text report.
+    """
+    start = text.rfind(JSON_FENCE)
+    if start == -1:
+        return text, None
+    match = JSON_BLOCK_RE.match(text, start)
+    if match is None:
+        return text, None
+    try:
+        structured = validate_structured_diagnosis(json.loads(match.group(1)))
+    except (ValueError, StructuredDiagnosisError):
+        return text, None
+    return text[:start].rstrip(), structured
+
+
+def visible_report(partial_text):
+    """The part of a streaming answer to show while it is still arriving"""
+    start = partial_text.find(JSON_FENCE)
+    return partial_text if start == -1 else partial_text[:start]
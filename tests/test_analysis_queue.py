@@ -0,0 +1,47 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from analysis_queue import AnalysisQueue
+from cache import ResultCache
+from pipeline import analyze_images_concurrently, image_analysis_key
+
+
+def test_rerun_cannot_cancel_analyses_a_diagnosis_is_waiting_on():
+    release_worker = threading.Event()
+
+    def analyze(image, equipment_type, context):
+        if image == "blocker":
+            release_worker.wait(5)
+        return f"ok {image.digest}"
+
+    queue = AnalysisQueue(analyze, ResultCache(max_entries=16), max_workers=1)
+    # Keep the only worker busy so every image analysis is still queued
+    queue.submit("blocker", "blocker", "HVAC System", "")
+    images = [SimpleNamespace(digest=str(i)) for i in range(3)]
+    keys = [image_analysis_key(image.digest, "HVAC System", "High") for image in images]
+    collected = {}
+    results = analyze_images_concurrently(images, "HVAC System", "High", queue)
+    waiting = threading.Thread(target=lambda: collected.update(results))
+    waiting.start()
+    while any(queue.lookup(key)[0] != "pending" for key in keys):
+        time.sleep(0.01)
+
+    # What the session's next rerun does after the form changes
+    for key in keys:
+        queue.cancel(key)
+    release_worker.set()
+    waiting.join(5)
+
+    assert collected == {0: "ok 0", 1: "ok 1", 2: "ok 2"}
+
+
+def test_unclaimed_analyses_are_still_cancelled():
+    release_worker = threading.Event()
+    queue = AnalysisQueue(lambda image, *_: release_worker.wait(5) and "ok", ResultCache(max_entries=16),
+                          max_workers=1)
+    queue.submit("blocker", "blocker", "HVAC System", "")
+    queue.submit("photo", "photo", "HVAC System", "")
+    queue.cancel("photo")
+    release_worker.set()
+    assert queue.lookup("photo") == (None, None)
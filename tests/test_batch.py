@@ -0,0 +1,23 @@
+import io
+
+from batch import read_cases
+
+
+def test_malformed_jsonl_rows_are_skipped_not_fatal(tmp_path):
+    path = tmp_path / "cases.jsonl"
+    path.write_text(
+        '{"issue_description": "pump leaks at the seal"}\n'
+        '{"issue_description": "truncated\n'
+        '\n'
+        '["not", "an", "object"]\n'
+        '{"issue_description": "fan bearing noise"}\n',
+        encoding="utf-8"
+    )
+    log = io.StringIO()
+
+    cases = list(read_cases(str(path), log))
+
+    assert [case['issue_description'] for case in cases] == ["pump leaks at the seal", "fan bearing noise"]
+    skipped = log.getvalue().splitlines()
+    assert len(skipped) == 2
+    assert all(line.startswith("[skip] row ") for line in skipped)
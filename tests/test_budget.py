@@ -0,0 +1,96 @@
+import pytest
+
+from budget import PromptAssembler
+from prompts import attached_images_section
+from structured import STRUCTURED_OUTPUT_INSTRUCTIONS
+
+CASE = {
+    'equipment_type': "Pumps",
+    'severity': "High",
+    'urgency': "Immediate",
+    'environment': ["outdoor"],
+    'symptoms': ["leak", "noise"],
+    'images_count': 2,
+    'issue_description': "Centrifugal pump leaking at the mechanical seal after restart",
+}
+INSIGHTS = [
+    {'count': count, 'common_issues': [f"{issue} failure"], 'severity_dist': {"High": count},
+     'symptoms': ["leak"]}
+    for count, issue in ((9, "seal"), (5, "bearing"), (2, "impeller"))
+]
+SIMILAR_CASES = [
+    {'similarity_score': score, 'severity': "High", 'issue_description': description, 'key_issues': ["worn seal"]}
+    for score, description in ((0.4, "pump seal weeping under load"), (0.8, "seal leak on the discharge side"))
+]
+# Ten distinct findings, so every FINDING_LIMITS step has something to cut
+ANALYSIS = "\n".join(f"Finding {word}: corrosion visible around {word} housing bolts" for word in (
+    "alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet"
+))
+
+
+class StubCounter:
+    """Four characters per token, like the Gemini tokenizer on English text"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return len(text) // 4
+
+
+def assemble(budget, counter=None):
+    assembler = PromptAssembler(counter or StubCounter(), budget)
+    return assembler.assemble(CASE, INSIGHTS, [ANALYSIS], expert_mode=True, attached_images=2,
+                              similar_cases=SIMILAR_CASES, structured_output=True)
+
+
+def test_over_budget_trims_lowest_value_first_and_keeps_the_case():
+    prompt, report = assemble(budget=1)
+
+    assert report['trimmed'] == [
+        "similar case", "similar case",
+        "learned pattern", "learned pattern",
+        "expert template",
+        "image findings", "image findings", "image findings",
+        "learned pattern",
+    ]
+    assert report['over_budget'] and report['exact']
+    assert report['tokens'] == len(prompt) // 4
+    # The case, the attached-image notes and the output format are never cut
+    assert "MAINTENANCE DIAGNOSIS REQUEST" in prompt
+    assert CASE['issue_description'] in prompt
+    assert attached_images_section(2) in prompt
+    assert STRUCTURED_OUTPUT_INSTRUCTIONS in prompt
+
+
+def test_trimming_stops_once_the_prompt_fits():
+    full_prompt, full_report = assemble(budget=0)
+    least_similar = SIMILAR_CASES[0]['issue_description']
+    assert least_similar in full_prompt
+
+    prompt, report = assemble(budget=full_report['tokens'] - 10)
+
+    assert report['trimmed'] == ["similar case"]
+    assert not report['over_budget']
+    assert least_similar not in prompt
+    assert SIMILAR_CASES[1]['issue_description'] in prompt
+
+
+def test_prompt_within_budget_is_counted_once():
+    counter = StubCounter()
+    _prompt, report = assemble(budget=100000, counter=counter)
+
+    assert report['trimmed'] == []
+    assert not report['over_budget']
+    assert counter.calls == 1
+
+
+def test_failed_counts_fall_back_to_an_estimate():
+    def unavailable(text):
+        raise RuntimeError("count_tokens unavailable")
+
+    prompt, report = assemble(budget=0, counter=unavailable)
+
+    assert not report['exact']
+    assert report['tokens'] == pytest.approx(len(prompt) / 4, abs=1)
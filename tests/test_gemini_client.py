@@ -0,0 +1,23 @@
+import pytest
+
+from gemini_client import GeminiClient
+
+
+class Throttled(Exception):
+    code = 429
+
+
+class ThrottledCounter:
+    def count_tokens(self, contents):
+        raise Throttled("count_tokens quota exhausted")
+
+
+def test_throttled_token_counts_do_not_open_the_generation_breaker():
+    client = GeminiClient(failure_threshold=2)
+    client.model = lambda model_name=None, generation_config=None: ThrottledCounter()
+
+    for _ in range(5):
+        with pytest.raises(Throttled):
+            client.count_tokens("prompt")
+
+    assert client.breaker.state == "closed"
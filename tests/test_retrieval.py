@@ -0,0 +1,43 @@
+from retrieval import CaseVectorIndex
+
+CASES = [
+    ("compressor short cycling with high head pressure", "HVAC System"),
+    ("compressor short cycling after filter change", "HVAC System"),
+    ("pump seal leaking at high pressure", "Pumps"),
+    ("compressor motor overheating and short cycling", "Pumps"),
+    ("conveyor belt slipping on the drive pulley", "Conveyors"),
+]
+
+
+def build(initial_capacity=1):
+    index = CaseVectorIndex(dimensions=256, initial_capacity=initial_capacity)
+    index.add_many((text, {'id': i}, equipment_type) for i, (text, equipment_type) in enumerate(CASES))
+    return index
+
+
+def test_equipment_filter_only_scores_that_type():
+    matches = build().search(["compressor short cycling"], k=3, equipment_type="Pumps", min_score=0.0)[0]
+
+    assert [record['id'] for _score, record in matches][0] == 3
+    assert {record['id'] for _score, record in matches} <= {2, 3}
+    assert build().search(["compressor"], equipment_type="Boilers") == [[]]
+
+
+def test_unfiltered_search_merges_types_best_first():
+    index = build()
+    matches = index.search(["compressor short cycling", "belt slipping"], k=3)
+
+    assert len(index) == len(CASES)
+    assert {record['id'] for _score, record in matches[0]} == {0, 1, 3}
+    assert [score for score, _record in matches[0]] == sorted((score for score, _record in matches[0]), reverse=True)
+    assert [record['id'] for _score, record in matches[1]] == [4]
+
+
+def test_rows_survive_growth_one_case_at_a_time():
+    index = CaseVectorIndex(dimensions=256, initial_capacity=1)
+    for i, (text, equipment_type) in enumerate(CASES * 3):
+        index.add(text, {'id': i}, equipment_type=equipment_type)
+
+    matches = index.search(["conveyor belt slipping"], k=3, equipment_type="Conveyors")[0]
+    assert sorted(record['id'] for _score, record in matches) == [4, 9, 14]
+    assert all(abs(score - matches[0][0]) < 0.05 for score, _record in matches)
@@ -0,0 +1,36 @@
+from knowledge import KnowledgeBase
+from storage import KnowledgeStore
+
+
+def case(description):
+    return {'timestamp': "2024-01-01T00:00:00", 'equipment_type': "Pumps", 'severity': "High",
+            'issue_description': description}
+
+
+def learn(knowledge_base, issue):
+    knowledge_base.learn_from_case("Pumps", ["leak"], ["outdoor"], f"Cause: {issue}.", "High")
+
+
+def test_two_writers_on_one_database_keep_every_case_and_count(tmp_path):
+    path = str(tmp_path / "knowledge.db")
+    app = KnowledgeBase(KnowledgeStore(path))
+    batch = KnowledgeBase(KnowledgeStore(path))
+
+    app_case, batch_case = case("app case"), case("batch case")
+    app.record_case(app_case)
+    batch.record_case(batch_case)
+    learn(app, "worn seal")
+    learn(batch, "cracked housing")
+    learn(app, "worn seal")
+    app.flush()
+    batch.flush()
+
+    assert app_case['id'] != batch_case['id']
+    reader = KnowledgeStore(path)
+    stored = {stored_case['id']: stored_case['issue_description'] for stored_case in reader.iter_cases()}
+    assert stored == {app_case['id']: "app case", batch_case['id']: "batch case"}
+
+    (pattern,) = reader.load_patterns("Pumps").values()
+    assert pattern['count'] == 3
+    assert pattern['issues']['counts'] == {"worn seal": 2, "cracked housing": 1}
+    assert reader.load_equipment_insights()["Pumps"]['total_cases'] == 3
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from structured import StructuredDiagnosisError, split_structured_diagnosis, validate_structured_diagnosis
+
+REPORT = "LIKELY CAUSE: worn mechanical seal.\n\nREPAIR STEPS: isolate power, replace the seal."
+FIELDS = {
+    'root_causes': ["worn mechanical seal", "misaligned shaft"],
+    'urgency': "High",
+    'parts': ["mechanical seal"],
+    'steps': ["isolate power", "replace the seal"],
+    'safety': ["lockout/tagout"],
+}
+
+
+def answer(fields=FIELDS, report=REPORT, after=""):
+    return f"{report}\n\n```json\n{json.dumps(fields)}\n```{after}"
+
+
+def test_valid_trailing_block_is_split_from_the_report():
+    report, structured = split_structured_diagnosis(answer())
+
+    assert report == REPORT
+    assert structured == FIELDS
+
+
+def test_text_after_the_closing_fence_is_not_structured():
+    text = answer(after="\n\nLet me know if you need anything else.")
+
+    assert split_structured_diagnosis(text) == (text, None)
+
+
+def test_empty_root_causes_are_rejected():
+    text = answer(dict(FIELDS, root_causes=[]))
+
+    assert split_structured_diagnosis(text) == (text, None)
+    with pytest.raises(StructuredDiagnosisError):
+        validate_structured_diagnosis(dict(FIELDS, root_causes=["  "]))
+
+
+@pytest.mark.parametrize("urgency, expected", [
+    ("high", "High"), ("  CRITICAL ", "Critical"), ("Urgent", None), (3, None), (None, None),
+])
+def test_urgency_is_matched_case_insensitively(urgency, expected):
+    assert validate_structured_diagnosis(dict(FIELDS, urgency=urgency))['urgency'] == expected
+
+
+def test_non_string_list_items_are_rejected():
+    text = answer(dict(FIELDS, parts=["mechanical seal", {"name": "gasket"}]))
+
+    assert split_structured_diagnosis(text) == (text, None)
+    with pytest.raises(StructuredDiagnosisError):
+        validate_structured_diagnosis(dict(FIELDS, root_causes=["worn seal", 42]))
+
+
+def test_earlier_unrelated_json_fence_stays_in_the_report():
+    report_with_example = REPORT + '\n\nExample sensor log:\n```json\n{"vibration_mm_s": 7.1}\n```\nCheck the seal first.'
+
+    report, structured = split_structured_diagnosis(answer(report=report_with_example))
+
+    assert report == report_with_example
+    assert structured == FIELDS